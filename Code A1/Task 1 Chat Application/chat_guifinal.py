@@ -1,83 +1,257 @@
 import tkinter as tk
-from tkinter import scrolledtext, messagebox
+from tkinter import scrolledtext, messagebox, ttk
 import pika
 import threading
+import queue
+import json
+import uuid
 
 """ tkinter: GUI toolkit.
 scrolledtext: Widget with a scrollable text box.
 messagebox: To show popup alerts.
+ttk: Notebook widget, one tab per room.
 pika: Python client to interact with RabbitMQ.
-threading: Runs message listening in the background so the GUI stays responsive."""
+threading: Runs message listening in the background so the GUI stays responsive.
+queue: Hands received messages from the listener thread to the GUI thread.
+json, uuid: Asking the history service for earlier messages (history_service.py)."""
+
+DEFAULT_SCROLLBACK = 1000  # lines kept in each room's chat log; older ones are dropped
+FRAME_MS = 50              # how often received messages are drawn
+DEFAULT_HISTORY = 50       # earlier messages shown on joining
+HISTORY_TIMEOUT = 2        # seconds to wait for the history service before giving up on it
+HISTORY_QUEUE = "chat_history"
+CHAT_EXCHANGE = "chat"     # topic exchange for every room
+ROOM_KEY = "room."         # a room's routing key is room.<name>
+
+def room_key(room):
+    return ROOM_KEY + room
+
+def valid_room(room):
+    # * and # are wildcards in topic bindings, so they cannot be in a room name
+    return room and "*" not in room and "#" not in room
 
 class ChatClientGUI:
-# Initializes a Chat Window
+# Initializes a Chat Window, with a tab per room
     
-    def __init__(self, root, username, room, host="localhost", port=5672):
+    def __init__(self, root, username, rooms, host="localhost", port=5672, scrollback=DEFAULT_SCROLLBACK,
+                 history=DEFAULT_HISTORY, history_since=None):
     # Constructor: init 
-    # Takes in Tk root, username, room, and optional RabbitMQ connection info.
+    # Takes in Tk root, username, the rooms to join, and optional RabbitMQ
+    # connection info, how many lines of chat to keep per room, and which
+    # earlier messages to show on joining: the last `history`, or everything
+    # since the `history_since` timestamp.
         self.root = root
-        self.root.title(f"Chat - {username} in {room}")
-            # f: formatted string literal
-            # It's cleaner and easier than using "Chat - " + username + " in " + room
+        self.root.title(f"Chat - {username}")
             # sets title
         self.username = username
             #stores username (standard pattern)
-        self.room = room
-            #stores room name
+        self.scrollback = scrollback
+            #most lines each chat log holds
+        self.incoming = queue.SimpleQueue()
+            # The listener thread only puts (room, message) here; Tk widgets
+            # are only touched from the GUI thread, in render_messages()
+        self.history = history
+        self.history_since = history_since
+        self.history_requests = {}
+            # { correlation ID: room } for history requests not yet answered
+        self.held = {}
+            # { room: [(id, text), ...] } live messages that arrived before
+            # the room's history
+        self.tabs = {}
+            # { room: ScrolledText }
+        self.listening = False
 
         # GUI elements
-        self.chat_log = scrolledtext.ScrolledText(root, state='disabled', wrap=tk.WORD, width=60, height=20)
-        self.chat_log.grid(row=0, column=0, columnspan=2, padx=10, pady=10)
-            # Read-only chat display area
+        self.notebook = ttk.Notebook(root)
+        self.notebook.grid(row=0, column=0, columnspan=3, padx=10, pady=10)
+            # One read-only chat display per room
         
         self.message_entry = tk.Entry(root, width=50)
         self.message_entry.grid(row=1, column=0, padx=10, pady=10)
         self.message_entry.bind("<Return>", self.send_message)
-            # Message entry box. Pressing enter sends message.
+            # Message entry box. Pressing enter sends message to the room on show.
 
         self.send_button = tk.Button(root, text="Send", width=10, command=self.send_message)
         self.send_button.grid(row=1, column=1, padx=10, pady=10)
             # Send Button
-        
 
-        # Connect to RabbitMQ
+        self.room_entry = tk.Entry(root, width=50)
+        self.room_entry.grid(row=2, column=0, padx=10, pady=10)
+        self.room_entry.bind("<Return>", lambda event: self.join_room(self.room_entry.get().strip()))
+        tk.Button(root, text="Join", width=10,
+                  command=lambda: self.join_room(self.room_entry.get().strip())).grid(row=2, column=1, padx=10, pady=10)
+        tk.Button(root, text="Leave", width=10, command=self.leave_room).grid(row=2, column=2, padx=10, pady=10)
+            # Join another room by name, or leave the one on show
+
+        # Connect to RabbitMQ: one connection, one channel and one queue for every room
         try:
             self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=host, port=port))
             self.channel = self.connection.channel()
 
-            # Setup exchange/queue EXCHANGE DECLARATION
-            self.exchange_name = f"room_{self.room}"
-            self.channel.exchange_declare(exchange=self.exchange_name, exchange_type="fanout")
-            
+            self.channel.exchange_declare(exchange=CHAT_EXCHANGE, exchange_type="topic")
             result = self.channel.queue_declare(queue='', exclusive=True)
             self.queue_name = result.method.queue
             # Queue Declaration: An exclusive, auto-deleted queue is created for the client.
-            self.channel.queue_bind(exchange=self.exchange_name, queue=self.queue_name)
-            # Queue Binding: The queue is bound to the room's exchange, enabling message reception.
+            # Joining a room binds it to room.<name>; leaving unbinds it.
+
+            for room in rooms:
+                self.join_room(room)
 
-            # Start receiving messages
+            # Start receiving messages (history replies wait in our queue until then)
             self.start_listening()
+            self.root.after(FRAME_MS, self.render_messages)
 
         except Exception as e:
             messagebox.showerror("Connection Error", f"Could not connect to RabbitMQ:\n{e}")
             root.destroy()
 
-    def display_message(self, message):
-        self.chat_log.config(state='normal')
-        self.chat_log.insert(tk.END, message + '\n')
-        self.chat_log.config(state='disabled')
-        self.chat_log.see(tk.END)
+    def on_connection(self, work):
+        # A BlockingConnection must only be used from one thread. Once the
+        # listener thread is consuming, channel work is handed to it.
+        if self.listening:
+            self.connection.add_callback_threadsafe(work)
+        else:
+            work()
+
+    def current_room(self):
+        tab = self.notebook.select()
+        for room, chat_log in self.tabs.items():
+            if str(chat_log) == tab:
+                return room
+        return None
+
+    def join_room(self, room):
+        if not valid_room(room):
+            messagebox.showwarning("Room", "Room names cannot be empty or contain * or #.")
+            return
+        self.room_entry.delete(0, tk.END)
+        if room in self.tabs:
+            self.notebook.select(self.tabs[room])
+            return
+
+        chat_log = scrolledtext.ScrolledText(self.notebook, state='disabled', wrap=tk.WORD, width=60, height=20)
+        self.notebook.add(chat_log, text=room)
+        self.notebook.select(chat_log)
+        self.tabs[room] = chat_log
+
+        correlation_id = self.history_request(room)
+        if correlation_id:
+            self.held[room] = []
+
+        def bind():
+            # Bind before asking for history, so nothing falls in between
+            self.channel.queue_bind(exchange=CHAT_EXCHANGE, queue=self.queue_name, routing_key=room_key(room))
+            if correlation_id:
+                self.send_history_request(room, correlation_id)
+
+        self.on_connection(bind)
+
+    def leave_room(self):
+        room = self.current_room()
+        if room is None:
+            return
+        self.notebook.forget(self.tabs[room])
+        self.tabs.pop(room).destroy()
+
+        def unbind():
+            self.channel.queue_unbind(exchange=CHAT_EXCHANGE, queue=self.queue_name, routing_key=room_key(room))
+            self.held.pop(room, None)
+            for correlation_id, requested in list(self.history_requests.items()):
+                if requested == room:
+                    del self.history_requests[correlation_id]
+
+        self.on_connection(unbind)
+
+    def display_message(self, room, message):
+        # Safe from any thread: the message is drawn on the next tick
+        self.incoming.put((room, message))
+
+    def render_messages(self):
+        # Everything received since the last tick goes in as one insert per
+        # room, with one state toggle and one scroll
+        batches = {}
+        for _ in range(self.incoming.qsize()):
+            room, message = self.incoming.get_nowait()
+            batches.setdefault(room, []).append(message)
+
+        for room, messages in batches.items():
+            chat_log = self.tabs.get(room)
+            if chat_log is None:
+                continue  # left the room while these were on their way
+            chat_log.config(state='normal')
+            chat_log.insert(tk.END, '\n'.join(messages) + '\n')
+            # Drop the oldest lines beyond the scrollback limit
+            lines = int(chat_log.index('end-1c').split('.')[0]) - 1
+            if lines > self.scrollback:
+                chat_log.delete('1.0', f'{lines - self.scrollback + 1}.0')
+            chat_log.config(state='disabled')
+            chat_log.see(tk.END)
+        self.root.after(FRAME_MS, self.render_messages)
 
     def send_message(self, event=None):
         message = self.message_entry.get().strip()
-        if message:
+        room = self.current_room()
+        if message and room:
             full_message = f"[{self.username}]: {message}"
-            self.channel.basic_publish(exchange=self.exchange_name, routing_key="", body=full_message.encode())
+            properties = pika.BasicProperties(message_id=str(uuid.uuid4()))
+                # lets a joining client tell history and live messages apart
+            self.on_connection(lambda: self.channel.basic_publish(
+                exchange=CHAT_EXCHANGE,
+                routing_key=room_key(room),
+                properties=properties,
+                body=full_message.encode()
+            ))
             self.message_entry.delete(0, tk.END)
 
+    def history_request(self, room):
+        # Returns the correlation ID for the room's history request, or None
+        # when no history is wanted
+        if not self.history and self.history_since is None:
+            return None
+        return str(uuid.uuid4())
+
+    def send_history_request(self, room, correlation_id):
+        # Runs on the connection's thread
+        request = {"room": room}
+        if self.history_since is not None:
+            request["since"] = self.history_since
+        else:
+            request["last"] = self.history
+        self.history_requests[correlation_id] = room
+        # The reply comes to our own queue, tagged with the request's ID
+        self.channel.basic_publish(
+            exchange="",
+            routing_key=HISTORY_QUEUE,
+            properties=pika.BasicProperties(reply_to=self.queue_name, correlation_id=correlation_id),
+            body=json.dumps(request).encode()
+        )
+        # No history service running: stop holding live messages back
+        self.connection.call_later(HISTORY_TIMEOUT, lambda: self.show_history(correlation_id, []))
+
+    def show_history(self, correlation_id, messages):
+        # Runs on the listener thread. Shows the history, then the live
+        # messages held back meanwhile, minus any the history already had
+        room = self.history_requests.pop(correlation_id, None)
+        if room is None:
+            return  # already answered, timed out, or the room was left
+        seen = set()
+        for message in messages:
+            self.display_message(room, message["text"])
+            seen.add(message["id"])
+        for message_id, text in self.held.pop(room, []):
+            if message_id is None or message_id not in seen:
+                self.display_message(room, text)
+
     def start_listening(self):
         def callback(ch, method, properties, body):
-            self.display_message(body.decode())
+            if properties.correlation_id in self.history_requests:
+                self.show_history(properties.correlation_id, json.loads(body.decode())["messages"])
+                return
+            room = method.routing_key[len(ROOM_KEY):]
+            if room in self.held:
+                self.held[room].append((properties.message_id, body.decode()))
+            else:
+                self.display_message(room, body.decode())
 
         def listen():
             self.channel.basic_consume(
@@ -90,6 +264,7 @@ class ChatClientGUI:
             except Exception as e:
                 print("Error in listener:", e)
 
+        self.listening = True
         threading.Thread(target=listen, daemon=True).start()
 
 
@@ -102,13 +277,14 @@ def show_login():
     username_entry = tk.Entry(login_win)
     username_entry.grid(row=0, column=1, padx=10, pady=10)
 
-    tk.Label(login_win, text="Room:").grid(row=1, column=0, padx=10, pady=10)
+    tk.Label(login_win, text="Rooms:").grid(row=1, column=0, padx=10, pady=10)
     room_entry = tk.Entry(login_win)
     room_entry.grid(row=1, column=1, padx=10, pady=10)
 
     def start_chat():
         username = username_entry.get().strip()
-        room = room_entry.get().strip() or "general"
+        rooms = [room.strip() for room in room_entry.get().split(",") if room.strip()] or ["general"]
+            # Several rooms can be joined at once, comma separated
 
         if not username:
             messagebox.showwarning("Missing Info", "Please enter a username.")
@@ -117,7 +293,7 @@ def show_login():
         login_win.destroy()
 
         chat_root = tk.Tk()
-        ChatClientGUI(chat_root, username, room)
+        ChatClientGUI(chat_root, username, rooms)
         chat_root.mainloop()
 
     join_button = tk.Button(login_win, text="Join Chat", command=start_chat)
@@ -0,0 +1,236 @@
+"""Room history service: records chat rooms and replays them to new joiners.
+
+Rooms are published to the `chat` topic exchange with routing key
+room.<name>. The service binds one durable queue to it with room.#, so it
+records every room from its first message, and appends each message to
+that room's log:
+
+    history/<room>/segment-<first message number>.log   the messages
+    history/<room>/segment-<first message number>.idx   the offset index
+
+A .log file is a run of records, each a u32 length and a JSON object
+{"ts", "id", "text"}. The matching .idx file holds one fixed-size entry per
+message, its byte position in the .log and its timestamp, so message n of
+a segment is found with one seek, and a timestamp with a binary search over
+the entries. A segment is closed once its log passes --segment-kb.
+
+A client asks for history by sending {"room": name, "last": N} or
+{"room": name, "since": epoch seconds} to the chat_history queue, with
+reply_to and correlation_id set. The reply is a single message,
+{"room": name, "messages": [{"ts", "id", "text"}, ...]}, oldest first and
+capped at --max-messages. Only the requested messages are read. Memory use
+is per room and per segment, and does not grow with the size of the logs.
+"""
+
+import argparse
+import bisect
+import json
+import os
+import struct
+import time
+from urllib.parse import quote
+import pika
+
+REQUEST_QUEUE = "chat_history"
+LOG_QUEUE = "chat_history_log"
+CHAT_EXCHANGE = "chat"
+ROOM_KEY = "room."
+LENGTH = struct.Struct("<I")
+INDEX_ENTRY = struct.Struct("<Qd")  # byte position in the .log, timestamp
+FLUSH_SECONDS = 1
+
+
+class RoomLog:
+    def __init__(self, directory, segment_bytes):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        # First message number and first timestamp of each segment, oldest first
+        self.bases = []
+        self.first_ts = []
+        for name in sorted(os.listdir(directory)):
+            if name.startswith("segment-") and name.endswith(".idx"):
+                base = int(name[len("segment-"):-len(".idx")])
+                entries = self.entries(base)
+                if entries:
+                    self.bases.append(base)
+                    self.first_ts.append(self.entry(base, 0)[1])
+
+        self.count = self.bases[-1] + self.entries(self.bases[-1]) if self.bases else 0
+        self.log_file = None
+        self.index_file = None
+
+    def path(self, base, suffix):
+        return os.path.join(self.directory, f"segment-{base:012d}{suffix}")
+
+    def entries(self, base):
+        return os.path.getsize(self.path(base, ".idx")) // INDEX_ENTRY.size
+
+    def entry(self, base, n):
+        with open(self.path(base, ".idx"), "rb") as f:
+            f.seek(n * INDEX_ENTRY.size)
+            return INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))
+
+    def append(self, ts, message_id, text):
+        if self.log_file is None or self.log_file.tell() >= self.segment_bytes:
+            self.roll()
+        record = json.dumps({"ts": ts, "id": message_id, "text": text}).encode()
+        self.index_file.write(INDEX_ENTRY.pack(self.log_file.tell(), ts))
+        self.log_file.write(LENGTH.pack(len(record)) + record)
+        if self.bases[-1] == self.count:
+            self.first_ts.append(ts)
+        self.count += 1
+
+    def roll(self):
+        # Carry on in the last segment after a restart unless it is full
+        if self.log_file is None and self.bases and os.path.getsize(self.path(self.bases[-1], ".log")) < self.segment_bytes:
+            base = self.bases[-1]
+        else:
+            self.close()
+            base = self.count
+            self.bases.append(base)
+        self.log_file = open(self.path(base, ".log"), "ab")
+        self.index_file = open(self.path(base, ".idx"), "ab")
+
+    def flush(self):
+        if self.log_file is not None:
+            self.log_file.flush()
+            self.index_file.flush()
+
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.index_file.close()
+            self.log_file = self.index_file = None
+
+    def offset_since(self, ts):
+        """Number of the first message at or after ts."""
+        self.flush()
+        segment = max(0, bisect.bisect_right(self.first_ts, ts) - 1)
+        if segment >= len(self.bases):
+            return self.count
+        base = self.bases[segment]
+        lo, hi = 0, self.entries(base)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.entry(base, mid)[1] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return base + lo
+
+    def read(self, start, limit):
+        """Up to limit messages from message number start on."""
+        self.flush()
+        messages = []
+        segment = max(0, bisect.bisect_right(self.bases, start) - 1)
+        while segment < len(self.bases) and len(messages) < limit:
+            base = self.bases[segment]
+            if start - base < self.entries(base):
+                position = self.entry(base, start - base)[0]
+                with open(self.path(base, ".log"), "rb") as f:
+                    f.seek(position)
+                    while len(messages) < limit:
+                        header = f.read(LENGTH.size)
+                        if len(header) < LENGTH.size:
+                            break
+                        length, = LENGTH.unpack(header)
+                        messages.append(json.loads(f.read(length)))
+            segment += 1
+            start = self.bases[segment] if segment < len(self.bases) else start
+        return messages
+
+
+class HistoryService:
+    def __init__(self, directory, segment_bytes, max_messages):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_messages = max_messages
+        self.rooms = {}  # { room: RoomLog }
+        os.makedirs(directory, exist_ok=True)
+
+    def room_log(self, room):
+        log = self.rooms.get(room)
+        if log is None:
+            log = self.rooms[room] = RoomLog(os.path.join(self.directory, quote(room, safe="")), self.segment_bytes)
+        return log
+
+    def record(self, room, message_id, text):
+        self.room_log(room).append(time.time(), message_id, text)
+
+    def answer(self, request):
+        log = self.room_log(request["room"])
+        if "since" in request:
+            start = log.offset_since(request["since"])
+            limit = self.max_messages
+        else:
+            limit = min(int(request.get("last", self.max_messages)), self.max_messages)
+            start = max(0, log.count - limit)
+        return {"room": request["room"], "messages": log.read(start, limit)}
+
+    def flush(self):
+        for log in self.rooms.values():
+            log.flush()
+
+    def close(self):
+        for log in self.rooms.values():
+            log.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Record chat rooms and replay their history to joining clients")
+    parser.add_argument("--host", default="localhost", help="RabbitMQ host")
+    parser.add_argument("--port", type=int, default=5672, help="RabbitMQ port")
+    parser.add_argument("--data", default="history", help="Directory for room logs (default: history)")
+    parser.add_argument("--segment-kb", type=int, default=4096, help="Size at which a room log segment is closed (default: 4096)")
+    parser.add_argument("--max-messages", type=int, default=500, help="Most messages in one reply (default: 500)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    service = HistoryService(args.data, args.segment_kb * 1024, args.max_messages)
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=args.host, port=args.port))
+    channel = connection.channel()
+
+    # Durable, so messages sent while the service restarts are still logged
+    channel.queue_declare(queue=LOG_QUEUE, durable=True)
+    channel.queue_declare(queue=REQUEST_QUEUE)
+    channel.exchange_declare(exchange=CHAT_EXCHANGE, exchange_type="topic")
+    channel.queue_bind(exchange=CHAT_EXCHANGE, queue=LOG_QUEUE, routing_key=ROOM_KEY + "#")
+
+    def on_message(ch, method, properties, body):
+        service.record(method.routing_key[len(ROOM_KEY):], properties.message_id, body.decode())
+
+    def on_request(ch, method, properties, body):
+        request = json.loads(body.decode())
+        reply = service.answer(request)
+        print(f"📜 Sent {len(reply['messages'])} messages of {request['room']} history")
+        channel.basic_publish(
+            exchange="",
+            routing_key=properties.reply_to,
+            properties=pika.BasicProperties(correlation_id=properties.correlation_id),
+            body=json.dumps(reply).encode()
+        )
+
+    def flush():
+        service.flush()
+        connection.call_later(FLUSH_SECONDS, flush)
+
+    connection.call_later(FLUSH_SECONDS, flush)
+    channel.basic_consume(queue=LOG_QUEUE, on_message_callback=on_message, auto_ack=True)
+    channel.basic_consume(queue=REQUEST_QUEUE, on_message_callback=on_request, auto_ack=True)
+
+    print("📡 History service is recording every room...")
+    try:
+        channel.start_consuming()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Rolling OHLCV and VWAP bars built incrementally from the trades feed.
+
+Every symbol gets one ring buffer per bar window (1s, 1m and 5m by
+default). A trade updates the current bar of each window in O(1), and a new
+bar overwrites the oldest one, so memory per symbol is fixed however long
+the feed runs.
+
+The aggregator has no GUI of its own: TradeMonitor feeds it, and running
+this file consumes the trades exchange headless and prints each bar as it
+completes.
+"""
+
+import argparse
+import time
+import pika
+import wire
+
+DEFAULT_WINDOWS = (1, 60, 300)  # seconds
+DEFAULT_HISTORY = 120           # bars kept per window
+
+
+class BarSeries:
+    """Ring buffer of the last `size` bars for one symbol and window.
+
+    Fields are stored column by column in preallocated lists.
+    """
+
+    def __init__(self, window, size=DEFAULT_HISTORY):
+        self.window = window
+        self.size = size
+        self.head = 0   # slot of the current bar
+        self.count = 0  # bars held so far, up to size
+        self.starts = [0.0] * size
+        self.opens = [0.0] * size
+        self.highs = [0.0] * size
+        self.lows = [0.0] * size
+        self.closes = [0.0] * size
+        self.volumes = [0] * size
+        self.notionals = [0.0] * size  # sum of price * quantity, for VWAP
+
+    def add(self, ts, price, quantity):
+        """Fold a trade into the current bar. Returns the bar it completed, if any."""
+        start = ts // self.window * self.window
+        i = self.head
+
+        # Trades stamped before the current bar (clock skew) still count towards it
+        if self.count and start <= self.starts[i]:
+            if price > self.highs[i]:
+                self.highs[i] = price
+            if price < self.lows[i]:
+                self.lows[i] = price
+            self.closes[i] = price
+            self.volumes[i] += quantity
+            self.notionals[i] += price * quantity
+            return None
+
+        completed = self.bar(i) if self.count else None
+        if self.count:
+            i = self.head = (i + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+        self.starts[i] = start
+        self.opens[i] = self.highs[i] = self.lows[i] = self.closes[i] = price
+        self.volumes[i] = quantity
+        self.notionals[i] = price * quantity
+        return completed
+
+    def bar(self, i):
+        return {
+            "start": self.starts[i],
+            "open": self.opens[i],
+            "high": self.highs[i],
+            "low": self.lows[i],
+            "close": self.closes[i],
+            "volume": self.volumes[i],
+            "vwap": self.notionals[i] / self.volumes[i] if self.volumes[i] else self.closes[i]
+        }
+
+    def latest(self):
+        return self.bar(self.head) if self.count else None
+
+    def bars(self):
+        """Bars held, oldest first."""
+        first = (self.head - self.count + 1) % self.size
+        return [self.bar((first + n) % self.size) for n in range(self.count)]
+
+
+class BarAggregator:
+    def __init__(self, windows=DEFAULT_WINDOWS, history=DEFAULT_HISTORY, on_bar=None):
+        self.windows = tuple(windows)
+        self.history = history
+        self.on_bar = on_bar  # called with (symbol, window, bar) when a bar completes
+        self.series = {}      # { symbol: { window: BarSeries } }
+
+    def add_trade(self, trade, ts=None):
+        ts = time.time() if ts is None else ts
+        symbol = trade["symbol"]
+        series = self.series.get(symbol)
+        if series is None:
+            series = self.series[symbol] = {w: BarSeries(w, self.history) for w in self.windows}
+
+        for window, bars in series.items():
+            completed = bars.add(ts, trade["price"], trade["quantity"])
+            if completed and self.on_bar:
+                self.on_bar(symbol, window, completed)
+
+    def latest(self, symbol, window):
+        return self.series[symbol][window].latest()
+
+    def bars(self, symbol, window):
+        return self.series[symbol][window].bars()
+
+
+def format_bar(symbol, window, bar):
+    return (f"{symbol} {window}s  O {bar['open']:.2f}  H {bar['high']:.2f}  L {bar['low']:.2f}  "
+            f"C {bar['close']:.2f}  V {bar['volume']}  VWAP {bar['vwap']:.2f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Print OHLCV/VWAP bars from the trades feed")
+    parser.add_argument("--host", default="localhost", help="RabbitMQ host")
+    parser.add_argument("--port", type=int, default=5672, help="RabbitMQ port")
+    parser.add_argument("--windows", default=",".join(map(str, DEFAULT_WINDOWS)),
+                        help="Comma-separated bar windows in seconds (default: 1,60,300)")
+    parser.add_argument("--history", type=int, default=DEFAULT_HISTORY,
+                        help=f"Bars kept per symbol and window (default: {DEFAULT_HISTORY})")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    windows = [int(w) for w in args.windows.split(",")]
+
+    def print_bar(symbol, window, bar):
+        print(f"📈 {format_bar(symbol, window, bar)}")
+
+    aggregator = BarAggregator(windows, args.history, on_bar=print_bar)
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=args.host, port=args.port))
+    channel = connection.channel()
+    channel.exchange_declare(exchange="trades", exchange_type="fanout")
+
+    result = channel.queue_declare(queue='', exclusive=True)
+    queue_name = result.method.queue
+    channel.queue_bind(exchange="trades", queue=queue_name)
+
+    def callback(ch, method, properties, body):
+        for trade in wire.decode_trades(body, properties.content_type):
+            aggregator.add_trade(trade)
+
+    print(f"📡 Aggregating trades into {', '.join(f'{w}s' for w in windows)} bars...")
+    channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
+    channel.start_consuming()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""Benchmark and replay harness for the matching engine. No broker needed.
+
+Orders come from a deterministic synthetic stream, or are replayed from a
+recorded log: a JSON-lines file of order messages (see --record) or an
+exchange journal segment. Each message goes through exchange.process, which
+is exchange.handle_message plus the timing --metrics turns on, or with
+--via-callback through exchange.callback with an in-process loopback channel
+standing in for RabbitMQ, which adds the wire decode and encode to every
+message.
+
+Replaying a journal also checks the trades against the ones it recorded, and
+every run prints a digest of its trades, so a book change that alters
+matching shows up as a mismatch.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import time
+import tracemalloc
+import exchange
+import wire
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the exchange's matching engine")
+    parser.add_argument("--orders", type=int, default=100000, help="Synthetic messages to generate (default: 100000)")
+    parser.add_argument("--symbols", type=int, default=10, help="Number of symbols (default: 10)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+    parser.add_argument("--mid", type=float, default=100.0, help="Mid price (default: 100)")
+    parser.add_argument("--spread", type=float, default=1.0, help="Std dev of prices around the mid (default: 1)")
+    parser.add_argument("--tick", type=float, default=0.01, help="Price tick size (default: 0.01)")
+    parser.add_argument("--max-quantity", type=int, default=500, help="Largest order quantity (default: 500)")
+    parser.add_argument("--buy-ratio", type=float, default=0.5, help="Share of new orders that buy (default: 0.5)")
+    parser.add_argument("--cancel-rate", type=float, default=0.1, help="Share of messages that are cancels (default: 0.1)")
+    parser.add_argument("--replay", metavar="FILE", help="Replay a recorded order log, or a journal segment written from empty books")
+    parser.add_argument("--record", metavar="FILE", help="Save the message stream as JSON lines for later replay")
+    parser.add_argument("--via-callback", action="store_true",
+                        help="Feed messages through exchange.callback with a loopback channel")
+    parser.add_argument("--wire", choices=wire.CONTENT_TYPES, default="json",
+                        help="Message format for --via-callback (default: json)")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the peak-memory pass")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Record the exchange's metrics (no HTTP server), to measure what they cost")
+    parser.add_argument("--expect-digest", help="Fail unless the trades hash to this digest")
+    return parser.parse_args()
+
+def generate_orders(args):
+    rng = random.Random(args.seed)
+    symbols = [f"S{i:03d}" for i in range(args.symbols)]
+    recent = []  # IDs that cancels pick from
+
+    messages = []
+    for i in range(args.orders):
+        symbol = rng.choice(symbols)
+        if recent and rng.random() < args.cancel_rate:
+            order_id, symbol = recent[rng.randrange(len(recent))]
+            messages.append({"type": "CANCEL", "order_id": order_id, "symbol": symbol})
+            continue
+
+        side = "BUY" if rng.random() < args.buy_ratio else "SELL"
+        ticks = round((args.mid + rng.gauss(0, args.spread)) / args.tick)
+        order = {
+            "type": "NEW",
+            "order_id": f"o{i}",
+            "username": f"trader{rng.randrange(100)}",
+            "side": side,
+            "price": round(max(ticks, 1) * args.tick, 6),
+            "quantity": rng.randint(1, args.max_quantity),
+            "symbol": symbol
+        }
+        messages.append(order)
+        recent.append((order["order_id"], symbol))
+        if len(recent) > 1000:
+            recent.pop(0)
+    return messages, []
+
+def load_log(path):
+    """Read order messages, plus any trades a journal recorded alongside them."""
+    messages, trades = [], []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "op" not in record:
+                messages.append(record)
+            elif record["op"] == "TRADE":
+                trades.append(record["data"])
+            elif record["op"] != "PUBLISHED":
+                messages.append(record["data"])
+    return messages, trades
+
+class LoopbackChannel:
+    """Stands in for a pika channel: keeps whatever the exchange publishes."""
+
+    def __init__(self):
+        self.trades = []
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.trades.extend(wire.decode_trades(body, properties.content_type))
+
+class Method:
+    routing_key = ""
+    delivery_tag = 0
+
+def reset_exchange(args):
+    exchange.order_books.clear()
+    exchange.journal = None
+    exchange.marketdata = None
+    exchange.verbose = False
+    exchange.trace = False
+    exchange.stats = exchange.ExchangeStats() if args.metrics else None
+
+def run(messages, args):
+    """Feed every message through the engine. Returns (trades, latencies in ns)."""
+    reset_exchange(args)
+    latencies = []
+    trades = []
+    clock = time.perf_counter_ns
+
+    if args.via_callback:
+        content_type = wire.CONTENT_TYPES[args.wire]
+        exchange.trade_properties.content_type = content_type
+        properties = exchange.pika.BasicProperties(content_type=content_type)
+        channel = LoopbackChannel()
+        for message in messages:
+            body = wire.encode_order(message, content_type)
+            start = clock()
+            exchange.callback(channel, Method, properties, body)
+            latencies.append(clock() - start)
+        trades = channel.trades
+    else:
+        for message in messages:
+            # The book fills orders in place, so hand it a copy
+            message = dict(message)
+            start = clock()
+            trades.extend(exchange.process(message, None))
+            latencies.append(clock() - start)
+
+    return trades, latencies
+
+def peak_memory(messages, args):
+    tracemalloc.start()
+    run(messages, args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+def digest(trades):
+    hasher = hashlib.sha256()
+    for trade in trades:
+        # Binary trades carry float prices, so normalise before hashing
+        trade = dict(trade, price=float(trade["price"]), quantity=int(trade["quantity"]))
+        hasher.update(json.dumps(trade, sort_keys=True).encode())
+    return hasher.hexdigest()[:16]
+
+def main():
+    args = parse_args()
+
+    if args.replay:
+        messages, recorded_trades = load_log(args.replay)
+        print(f"📂 Replaying {len(messages)} messages from {args.replay}")
+    else:
+        messages, recorded_trades = generate_orders(args)
+        print(f"🎲 Generated {len(messages)} messages across {args.symbols} symbols (seed {args.seed})")
+
+    if args.record:
+        with open(args.record, "w") as f:
+            for message in messages:
+                f.write(json.dumps(message) + "\n")
+        print(f"💾 Recorded the stream to {args.record}")
+
+    started = time.perf_counter()
+    trades, latencies = run(messages, args)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    resting = sum(len(book.index) for book in exchange.order_books.values())
+    print(f"⏱️ {len(messages) / elapsed:,.0f} orders/sec ({len(messages)} messages in {elapsed:.2f}s)")
+    print(f"   match latency p50 {percentile(latencies, 0.5) / 1000:.1f}µs  "
+          f"p99 {percentile(latencies, 0.99) / 1000:.1f}µs  "
+          f"p999 {percentile(latencies, 0.999) / 1000:.1f}µs  "
+          f"max {latencies[-1] / 1000:.1f}µs")
+    print(f"   {len(trades)} trades, {resting} orders resting")
+    if exchange.stats is not None:
+        match = exchange.stats.match
+        print(f"   metrics: {match.count()} matches timed, p99 under {match.quantile(0.99) * 1e6:g}µs")
+
+    if not args.no_memory:
+        print(f"   peak memory {peak_memory(messages, args) / 2**20:.1f} MiB (separate traced run)")
+
+    trade_digest = digest(trades)
+    print(f"🔑 Trade digest {trade_digest}")
+
+    failed = False
+    if recorded_trades:
+        if digest(recorded_trades) == trade_digest:
+            print(f"✅ Trades match the {len(recorded_trades)} recorded in the journal")
+        else:
+            print(f"❌ Trades differ from the {len(recorded_trades)} recorded in the journal")
+            failed = True
+    if args.expect_digest and args.expect_digest != trade_digest:
+        print(f"❌ Expected trade digest {args.expect_digest}")
+        failed = True
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,74 +1,421 @@
 import pika
+import argparse
+import collections
+import multiprocessing
+import os
+import time
+import uuid
+import zlib
 import json
+import metrics
+import wire
+from journal import Journal
+from market_data import DEFAULT_DEPTH, MarketData
+from order_book import OrderBook
 
-order_books = {}  # e.g., { "XYZ": { "BUY": [...], "SELL": [...] } }
+order_books = {}  # e.g., { "XYZ": OrderBook("XYZ") }
 
-buy_orders = []
-sell_orders = []
+verbose = True  # per-message logging; --quiet turns it off
 
-def match_order(order):
-    symbol = order["symbol"]
+# Trades go out in this format; --wire binary switches it
+trade_properties = pika.BasicProperties(content_type=wire.JSON)
+
+journal = None  # set by --journal
+
+# New orders and amends journaled since the last snapshot, so one the broker
+# redelivers after a crash is not applied twice. An amend sets absolute
+# values, so applying it again after fills would put filled shares back
+MESSAGE_IDS = {"NEW": "order_id", "AMEND": "amend_id"}  # the field naming each
+journaled_ids = set()  # { (kind, ID) }
+AUTO_ID = "auto-"  # prefix of IDs the exchange gives messages sent without one
+unnamed = collections.Counter()  # { (kind, fingerprint): count } of those messages
+
+unpublished = []  # journaled trades a crash kept from being published
+
+marketdata = None  # set by --marketdata
+
+trace = False      # stamp trades for latency tracing; set by --trace
+trade_seq = 0      # seq of the last trade stamped
+
+stats = None  # ExchangeStats, set by --metrics-port
+
+def get_book(symbol):
     if symbol not in order_books:
-        order_books[symbol] = {"BUY": [], "SELL": []}
-
-    book = order_books[symbol]
-    side = order["side"]
-
-    trades = []
-
-    if side == "BUY":
-        book["SELL"].sort(key=lambda o: o["price"])
-        for i, sell in enumerate(book["SELL"]):
-            if order["price"] >= sell["price"]:
-                matched_trade = {
-                    "symbol": symbol,
-                    "price": sell["price"],
-                    "buyer": order["username"],
-                    "seller": sell["username"],
-                    "quantity": 100
-                }
-                del book["SELL"][i]
-                trades.append(matched_trade)
-                break
-        if not trades:
-            book["BUY"].append(order)
-
-    else:  # SELL
-        book["BUY"].sort(key=lambda o: o["price"], reverse=True)
-        for i, buy in enumerate(book["BUY"]):
-            if buy["price"] >= order["price"]:
-                matched_trade = {
-                    "symbol": symbol,
-                    "price": order["price"],
-                    "buyer": buy["username"],
-                    "seller": order["username"],
-                    "quantity": 100
-                }
-                del book["BUY"][i]
-                trades.append(matched_trade)
-                break
-        if not trades:
-            book["SELL"].append(order)
-
-    return trades  # Always return a list
+        order_books[symbol] = OrderBook(symbol)
+        if marketdata is not None:
+            order_books[symbol].track_changes()
+    return order_books[symbol]
+
+def match_order(order):
+    # Orders from older clients arrive without an ID, so assign one here
+    order.setdefault("order_id", uuid.uuid4().hex)
+    book = get_book(order["symbol"])
+    if order["order_id"] in book.index:
+        print(f"⚠️ Rejected order with duplicate ID {order['order_id']}")
+        return []
+
+    return book.match(order)
+
+def cancel_order(message):
+    cancelled = get_book(message["symbol"]).cancel(message["order_id"])
+    if verbose:
+        if cancelled:
+            print(f"🗑️ Cancelled order {message['order_id']}")
+        else:
+            # Usual when a cancel races a fill, so only logged verbosely
+            print(f"⚠️ Cancel for unknown order {message['order_id']}")
+    return []
+
+def amend_order(message):
+    amended, trades = get_book(message["symbol"]).amend(
+        message["order_id"], message.get("price"), message.get("quantity")
+    )
+    if verbose:
+        if amended:
+            print(f"✏️ Amended order {message['order_id']}")
+        else:
+            print(f"⚠️ Amend for unknown order {message['order_id']}")
+    return trades
+
+message_handlers = {
+    "NEW": match_order,
+    "CANCEL": cancel_order,
+    "AMEND": amend_order
+}
+
+def handle_message(message):
+    # Messages without a type are plain new orders
+    kind = message.get("type", "NEW")
+    handler = message_handlers.get(kind)
+    if handler is None:
+        print(f"⚠️ Ignored message of unknown type {kind}")
+        return []
+
+    if journal is not None:
+        if kind in MESSAGE_IDS:
+            remember(kind, message)
+        journal.append(kind, message)
+
+    trades = handler(message)
+
+    if journal is not None:
+        for trade in trades:
+            journal.append("TRADE", trade)
+    if marketdata is not None:
+        marketdata.record(get_book(message["symbol"]))
+    return trades
+
+def fingerprint(message, field):
+    return json.dumps({key: value for key, value in message.items() if key != field}, sort_keys=True)
+
+def remember(kind, message):
+    """Note a new order or amend about to be journaled. One sent without an
+    ID gets one here, journaled so a replay rebuilds the same message."""
+    field = MESSAGE_IDS[kind]
+    if field not in message:
+        unnamed[(kind, fingerprint(message, field))] += 1
+        message[field] = AUTO_ID + uuid.uuid4().hex
+    journaled_ids.add((kind, message[field]))
+
+def recall(kind, data):
+    # remember() for a journaled message read back on recovery
+    field = MESSAGE_IDS[kind]
+    if field not in data:
+        return  # an amend journaled before amends had IDs
+    journaled_ids.add((kind, data[field]))
+    if data[field].startswith(AUTO_ID):
+        unnamed[(kind, fingerprint(data, field))] += 1
+
+def already_journaled(message, redelivered):
+    """True for a new order or amend the journal already holds.
 
+    One without an ID can only be recognised by its contents, so it is only
+    dropped when the broker flags it as redelivered: two identical orders
+    sent on purpose are both matched.
+    """
+    kind = message.get("type", "NEW")
+    field = MESSAGE_IDS.get(kind)
+    if field is None:
+        return False  # a repeated cancel changes nothing
+    if field in message:
+        return (kind, message[field]) in journaled_ids
+    if redelivered:
+        key = (kind, fingerprint(message, field))
+        if unnamed[key]:
+            unnamed[key] -= 1
+            return True
+    return False
+
+def reply_snapshot(ch, properties, message):
+    if marketdata is None or not properties.reply_to:
+        print(f"⚠️ Ignored snapshot request for {message['symbol']}; market data is off")
+        return
+    snapshot = marketdata.snapshot(get_book(message["symbol"]), message.get("depth", DEFAULT_DEPTH))
+    ch.basic_publish(
+        exchange="",
+        routing_key=properties.reply_to,
+        properties=pika.BasicProperties(correlation_id=properties.correlation_id),
+        body=json.dumps(snapshot).encode()
+    )
+
+def open_journal(directory, snapshot_every):
+    """Rebuild the order books from disk, then start journaling to it."""
+    global journal
+    recovered = Journal(directory, snapshot_every)
+
+    seq, books = recovered.load_snapshot()
+    for symbol, orders in books.items():
+        book = get_book(symbol)
+        for order in orders:
+            book.rest(order)
+
+    replayed = 0
+    for record in recovered.replay(seq):
+        op, data = record["op"], record["data"]
+        if op == "TRADE":
+            # Replaying the orders remakes the trades; the journaled ones only
+            # say which trades were made since the last publish
+            unpublished.append(data)
+        elif op == "PUBLISHED":
+            unpublished.clear()
+        else:
+            if op in MESSAGE_IDS:
+                recall(op, data)
+            handle_message(data)
+            replayed += 1
+
+    recovered.open_segment()
+    journal = recovered
+    print(f"💾 Recovered {len(order_books)} books from snapshot {seq} and {replayed} journaled messages")
+    if unpublished:
+        print(f"⚠️ {len(unpublished)} journaled trades may not have been published; publishing them on connect")
+
+def snapshot_books():
+    return {symbol: book.resting_orders() for symbol, book in order_books.items()}
+
+
+class ExchangeStats:
+    """The exchange's counters, gauges and latency histograms (metrics.py)."""
+
+    def __init__(self, clock="monotonic"):
+        self.clock = clock
+        self.registry = metrics.Registry()
+        self.orders = self.registry.counter("exchange_orders_total", "Order messages handled, by type", "type")
+        self.trades = self.registry.counter("exchange_trades_total", "Trades made")
+        self.queue_wait = self.registry.histogram(
+            "exchange_queue_wait_seconds", "From a stamped order being sent to the exchange receiving it")
+        self.decode = self.registry.histogram("exchange_decode_seconds", "Decoding an order message")
+        self.match = self.registry.histogram(
+            "exchange_match_seconds", "Handling an order: matching, journaling and market data")
+        self.publish = self.registry.histogram("exchange_publish_seconds", "Publishing a trade message")
+        self.registry.gauge("exchange_book_orders", "Live orders resting in each book", self.book_orders)
+        self.registry.gauge("exchange_book_levels", "Price levels with live orders, per book and side", self.book_levels)
+
+    def book_orders(self):
+        return [({"symbol": symbol}, len(book.index)) for symbol, book in list(order_books.items())]
+
+    def book_levels(self):
+        return [({"symbol": symbol, "side": name}, sum(1 for quantity in list(side.depth.values()) if quantity > 0))
+                for symbol, book in list(order_books.items()) for name, side in book.sides.items()]
+
+def receive(body, properties):
+    """Decode an order message. Returns (message, stamp); the stamp is taken
+    off the message so it never reaches the journal or the books."""
+    if stats is None:
+        message = wire.decode_order(body, properties.content_type)
+        stamp = message.pop("stamp", None)
+    else:
+        received = metrics.now(stats.clock)
+        started = time.perf_counter()
+        message = wire.decode_order(body, properties.content_type)
+        stats.decode.observe(time.perf_counter() - started)
+        stamp = message.pop("stamp", None)
+        if stamp is not None:
+            stats.queue_wait.observe(received - metrics.stamp_time(stamp, stats.clock))
+
+    if verbose:
+        print(f"📥 Received message: {message}")
+    return message, stamp
+
+def process(message, stamp):
+    """handle_message, timed when metrics are on. A traced order's stamp is
+    passed on to its trades."""
+    if stats is None:
+        trades = handle_message(message)
+    else:
+        started = time.perf_counter()
+        trades = handle_message(message)
+        stats.match.observe(time.perf_counter() - started)
+        stats.orders.inc(key=message.get("type", "NEW"))
+        stats.trades.inc(len(trades))
+
+    if trace and stamp is not None:
+        for trade in trades:
+            trade["order_stamp"] = stamp
+    return trades
+
+def publish_trades(channel, trades):
+    """Publish one trade or a batch of them as one message."""
+    global trade_seq
+    if trace:
+        for trade in [trades] if isinstance(trades, dict) else trades:
+            trade_seq += 1
+            trade["stamp"] = metrics.make_stamp(trade_seq)
+
+    if stats is not None:
+        started = time.perf_counter()
+    channel.basic_publish(
+        exchange="trades",
+        routing_key="",
+        properties=trade_properties,
+        body=wire.encode_trades(trades, trade_properties.content_type)
+    )
+    if stats is not None:
+        stats.publish.observe(time.perf_counter() - started)
 
 def callback(ch, method, properties, body):
-    order = json.loads(body.decode())
-    print(f"📥 Received order: {order}")
+    message, stamp = receive(body, properties)
+
+    if message.get("type") == "SNAPSHOT":
+        reply_snapshot(ch, properties, message)
+        return
+
+    trades = process(message, stamp)
 
-    trades = match_order(order)
-    
     for trade in trades:
-        print(f"✅ Trade executed: {trade}")
-        ch.basic_publish(
-            exchange="trades",
-            routing_key="",
-            body=json.dumps(trade).encode()
-        )
+        if verbose:
+            print(f"✅ Trade executed: {trade}")
+        publish_trades(ch, trade)
 
-def main():
-    connection = pika.BlockingConnection(pika.ConnectionParameters("localhost"))
+    if marketdata is not None:
+        marketdata.publish_due()
+
+class BatchConsumer:
+    """High-throughput consumer: buffers trades and acks, flushing them together.
+
+    A flush publishes every buffered trade as one message, in the order the
+    trades were made, and then acks every message consumed so far with a
+    single multiple=True ack. Flushes happen every batch_size messages and
+    every batch_ms milliseconds, whichever comes first.
+    """
+
+    def __init__(self, connection, channel, batch_size, batch_ms):
+        self.connection = connection
+        self.channel = channel
+        self.batch_size = batch_size
+        self.batch_ms = batch_ms
+        self.trades = []
+        self.unacked = 0
+        self.last_tag = None
+
+    def start(self, queue_name, prefetch):
+        self.channel.basic_qos(prefetch_count=prefetch)
+        self.channel.basic_consume(queue=queue_name, on_message_callback=self.on_message)
+        self.connection.call_later(self.batch_ms / 1000, self.on_timer)
+
+    def on_message(self, ch, method, properties, body):
+        message, stamp = receive(body, properties)
+        if message.get("type") == "AMEND" and properties.message_id:
+            # send_order.py names each amend in the message properties
+            message.setdefault("amend_id", properties.message_id)
+
+        if message.get("type") == "SNAPSHOT":
+            reply_snapshot(ch, properties, message)
+        elif journal is not None and already_journaled(message, method.redelivered):
+            kind = message.get("type", "NEW")
+            print(f"⚠️ Dropped redelivered {kind} {message.get(MESSAGE_IDS[kind], '(no ID)')}; it is already journaled")
+        else:
+            self.trades.extend(process(message, stamp))
+        self.last_tag = method.delivery_tag
+        self.unacked += 1
+        if self.unacked >= self.batch_size:
+            self.flush()
+
+    def on_timer(self):
+        self.flush()
+        self.connection.call_later(self.batch_ms / 1000, self.on_timer)
+
+    def flush(self):
+        # One fsync covers every message in the batch
+        if journal is not None:
+            journal.commit()
+
+        if self.trades:
+            if verbose:
+                for trade in self.trades:
+                    print(f"✅ Trade executed: {trade}")
+            publish_trades(self.channel, self.trades)
+            self.trades = []
+            if journal is not None:
+                # Made durable by the next commit; a crash before then
+                # publishes this batch's trades again on recovery
+                journal.append("PUBLISHED", {})
+
+        if marketdata is not None:
+            marketdata.publish_due()
+
+        # Ack only once the trades these orders produced have been published
+        if self.unacked:
+            self.channel.basic_ack(delivery_tag=self.last_tag, multiple=True)
+            self.unacked = 0
+
+        if journal is not None and journal.due_snapshot():
+            journal.write_snapshot(snapshot_books())
+            # Every order before the snapshot has been acked, so none comes back
+            journaled_ids.clear()
+            unnamed.clear()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Order matching exchange")
+    parser.add_argument("--host", default="localhost", help="RabbitMQ host")
+    parser.add_argument("--port", type=int, default=5672, help="RabbitMQ port")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Matching worker processes; symbols are sharded across them (default: 1)")
+    parser.add_argument("--batch", type=int, default=0,
+                        help="Publish trades and ack orders every N messages (default: 0, off)")
+    parser.add_argument("--batch-ms", type=float, default=50,
+                        help="Also flush a batch after this many milliseconds (default: 50)")
+    parser.add_argument("--prefetch", type=int, default=1000,
+                        help="Unacked orders the broker may deliver in batch mode, "
+                             "and to the router with --journal (default: 1000)")
+    parser.add_argument("--quiet", action="store_true", help="Don't log every order and trade")
+    parser.add_argument("--wire", choices=wire.CONTENT_TYPES, default="json",
+                        help="Format to publish trades in; orders are read in either (default: json)")
+    parser.add_argument("--journal", metavar="DIR",
+                        help="Journal orders to DIR and recover the books from it on startup. "
+                             "Implies batch mode (default --batch 100). Keep --workers the same across restarts")
+    parser.add_argument("--marketdata", action="store_true",
+                        help="Publish level-2 depth updates to the marketdata exchange")
+    parser.add_argument("--md-conflate-ms", type=float, default=0,
+                        help="Merge depth updates over this many milliseconds (default: 0, publish each change)")
+    parser.add_argument("--snapshot-every", type=int, default=100000,
+                        help="Snapshot the books every N journal records (default: 100000)")
+    parser.add_argument("--trace", action="store_true",
+                        help="Stamp trades with send times and a sequence number, and pass on the orders' stamps")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="Serve Prometheus metrics on this local port; worker N uses port + N "
+                             "(default: 0, off)")
+    parser.add_argument("--clock", choices=metrics.CLOCKS, default="monotonic",
+                        help="Clock for latencies between processes; wall across hosts (default: monotonic)")
+    args = parser.parse_args()
+    if args.journal and not args.batch:
+        # Acks have to wait for the journal's fsync, which batch mode does
+        args.batch = 100
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.batch and args.prefetch < args.batch:
+        parser.error("--prefetch must be at least --batch, or batches can never fill")
+    return args
+
+def shard_for(symbol, workers):
+    # crc32 rather than hash() so every process agrees on the shard
+    return zlib.crc32(symbol.encode()) % workers
+
+def shard_queue(shard):
+    return f"orders-shard-{shard}"
+
+def connect(host, port):
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=host, port=port))
     channel = connection.channel()
 
     # Set up orders exchange to receive
@@ -77,14 +424,160 @@ def main():
     # Set up trades exchange to publish
     channel.exchange_declare(exchange="trades", exchange_type="fanout")
 
-    # Declare a temporary queue for this exchange to listen
-    result = channel.queue_declare(queue='', exclusive=True)
-    queue_name = result.method.queue
+    # Direct exchange the router uses to hand each symbol to its worker
+    channel.exchange_declare(exchange="orders-shards", exchange_type="direct")
+
+    # Depth updates, routed by symbol
+    channel.exchange_declare(exchange="marketdata", exchange_type="topic")
+
+    return connection, channel
+
+def declare_orders_queue(channel, durable):
+    if durable:
+        # A named durable queue holds orders sent while the exchange is down
+        queue_name = "exchange-orders"
+        channel.queue_declare(queue=queue_name, durable=True)
+    else:
+        # Declare a temporary queue for this exchange to listen
+        result = channel.queue_declare(queue='', exclusive=True)
+        queue_name = result.method.queue
     channel.queue_bind(exchange="orders", queue=queue_name)
+    return queue_name
+
+def declare_shard_queue(channel, shard, durable):
+    queue_name = shard_queue(shard)
+    channel.queue_declare(queue=queue_name, durable=durable, auto_delete=not durable)
+    channel.queue_bind(exchange="orders-shards", queue=queue_name, routing_key=queue_name)
+    return queue_name
+
+def consume(connection, channel, queue_name, args):
+    global marketdata
+    if args.marketdata:
+        # Started after any journal replay, so recovery publishes nothing
+        marketdata = MarketData(args.md_conflate_ms)
+        for book in order_books.values():
+            book.track_changes()
+        marketdata.start(connection, channel)
+
+    if unpublished:
+        publish_trades(channel, unpublished)
+        journal.append("PUBLISHED", {})
+        journal.commit()
+        print(f"📤 Published {len(unpublished)} recovered trades")
+        unpublished.clear()
+
+    consumer = None
+    if args.batch > 0:
+        consumer = BatchConsumer(connection, channel, args.batch, args.batch_ms)
+        consumer.start(queue_name, args.prefetch)
+    else:
+        channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
+    try:
+        channel.start_consuming()
+    except KeyboardInterrupt:
+        # Journal, publish and ack whatever the last batch holds
+        if consumer is not None:
+            consumer.flush()
+        raise
+
+def configure(args):
+    global verbose, trade_properties, trace
+    verbose = not args.quiet
+    trade_properties = pika.BasicProperties(content_type=wire.CONTENT_TYPES[args.wire])
+    trace = args.trace
+
+def start_metrics(port, clock):
+    global stats
+    stats = ExchangeStats(clock)
+    metrics.serve(stats.registry, port)
+
+def run_worker(shard, args):
+    configure(args)
+    if args.journal:
+        open_journal(os.path.join(args.journal, f"shard-{shard}"), args.snapshot_every)
+    if args.metrics_port:
+        start_metrics(args.metrics_port + shard, args.clock)
+
+    # Each worker process owns the order books for its shard outright
+    connection, channel = connect(args.host, args.port)
+    queue_name = declare_shard_queue(channel, shard, bool(args.journal))
+
+    print(f"⚙️ Worker {shard} is running. Waiting for orders...")
+    try:
+        consume(connection, channel, queue_name, args)
+    except KeyboardInterrupt:
+        connection.close()
+
+def run_router(args):
+    workers = args.workers
+    connection, channel = connect(args.host, args.port)
+    for shard in range(workers):
+        declare_shard_queue(channel, shard, bool(args.journal))
+
+    pool = [
+        multiprocessing.Process(target=run_worker, args=(shard, args), daemon=True)
+        for shard in range(workers)
+    ]
+    for process in pool:
+        process.start()
+
+    queue_name = declare_orders_queue(channel, bool(args.journal))
+
+    # With a journal, an order leaves the durable queue only once it is in a
+    # worker's queue, and the broker hands over at most --prefetch at a time
+    durable = bool(args.journal)
+    if durable:
+        channel.basic_qos(prefetch_count=args.prefetch)
+
+    def route(ch, method, properties, body):
+        # send_order.py puts the symbol in the routing key, which saves decoding
+        # the body here; fall back to the body for older senders
+        symbol = method.routing_key or wire.decode_order(body, properties.content_type)["symbol"]
+        ch.basic_publish(
+            exchange="orders-shards",
+            routing_key=shard_queue(shard_for(symbol.upper(), workers)),
+            properties=properties,
+            body=body
+        )
+        if durable:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    print(f"📡 Exchange is routing orders across {workers} workers...")
+    channel.basic_consume(queue=queue_name, on_message_callback=route, auto_ack=not durable)
+    try:
+        channel.start_consuming()
+    except KeyboardInterrupt:
+        connection.close()
+    finally:
+        # Ctrl-C reaches the workers too; give them time to flush their last batch
+        for process in pool:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+def main():
+    args = parse_args()
+    configure(args)
+
+    if args.workers > 1:
+        run_router(args)
+        return
+
+    if args.journal:
+        open_journal(args.journal, args.snapshot_every)
+    # Started after recovery, so replayed orders are not counted
+    if args.metrics_port:
+        start_metrics(args.metrics_port, args.clock)
+
+    connection, channel = connect(args.host, args.port)
+    queue_name = declare_orders_queue(channel, bool(args.journal))
 
     print("📡 Exchange is running. Waiting for orders...")
-    channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
-    channel.start_consuming()
+    try:
+        consume(connection, channel, queue_name, args)
+    except KeyboardInterrupt:
+        connection.close()
 
 if __name__ == "__main__":
     main()
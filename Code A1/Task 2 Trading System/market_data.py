@@ -0,0 +1,183 @@
+"""Level-2 market data: per-price-level depth updates from the exchange.
+
+The exchange publishes depth deltas to the `marketdata` topic exchange with
+the symbol as routing key:
+
+    {"symbol": "XYZ", "seq": 7, "levels": [
+        {"side": "BUY", "price": 10.0, "quantity": 300, "action": "change"}, ...]}
+
+`quantity` is the level's new total, so applying a delta twice is harmless.
+`action` is add, change or delete. The deltas come from the levels each
+match touched (OrderBook.take_changes), never from diffing whole books. With
+a conflation interval, the changes made during that interval are merged
+into one delta per level.
+
+A subscriber binds to the symbol first and then asks for a snapshot by
+sending {"type": "SNAPSHOT", "symbol": ..., "depth": N} on the orders
+exchange, with reply_to set. Sending it there routes it to whichever
+process owns the book, even with --workers. The reply carries the top N
+levels and the seq of the last delta published before it. Running this file
+does exactly that and prints the book as it changes.
+"""
+
+import argparse
+import json
+import pika
+
+DEFAULT_DEPTH = 10
+
+
+def level_delta(side, price, before, after):
+    action = "add" if before == 0 else "delete" if after == 0 else "change"
+    return {"side": side, "price": price, "quantity": after, "action": action}
+
+
+class MarketData:
+    """Collects depth changes from the exchange's books and publishes them."""
+
+    def __init__(self, conflate_ms=0):
+        self.conflate_ms = conflate_ms
+        self.pending = {}  # { symbol: { (side, price): [depth before, depth after] } }
+        self.seq = {}      # { symbol: seq of the last delta published }
+        self.channel = None
+
+    def start(self, connection, channel):
+        self.connection = connection
+        self.channel = channel
+        if self.conflate_ms:
+            connection.call_later(self.conflate_ms / 1000, self.on_timer)
+
+    def record(self, book):
+        changes = book.take_changes()
+        if not changes:
+            return
+        levels = self.pending.setdefault(book.symbol, {})
+        for side, price, before, after in changes:
+            level = levels.get((side, price))
+            if level is None:
+                levels[(side, price)] = [before, after]
+            else:
+                level[1] = after
+
+    def publish_due(self):
+        # Without conflation every message's changes go straight out
+        if not self.conflate_ms:
+            self.flush()
+
+    def on_timer(self):
+        self.flush()
+        self.connection.call_later(self.conflate_ms / 1000, self.on_timer)
+
+    def flush(self):
+        for symbol, levels in self.pending.items():
+            deltas = [level_delta(side, price, before, after)
+                      for (side, price), (before, after) in levels.items() if before != after]
+            if not deltas:
+                continue
+            seq = self.seq[symbol] = self.seq.get(symbol, 0) + 1
+            self.channel.basic_publish(
+                exchange="marketdata",
+                routing_key=symbol,
+                body=json.dumps({"symbol": symbol, "seq": seq, "levels": deltas}).encode()
+            )
+        self.pending.clear()
+
+    def snapshot(self, book, depth=DEFAULT_DEPTH):
+        return {
+            "symbol": book.symbol,
+            "seq": self.seq.get(book.symbol, 0),
+            "bids": book.sides["BUY"].top(depth),
+            "asks": book.sides["SELL"].top(depth)
+        }
+
+
+class LocalBook:
+    """A subscriber's copy of one symbol's depth, built from a snapshot and deltas."""
+
+    def __init__(self):
+        self.levels = {"BUY": {}, "SELL": {}}
+        self.seq = None      # None until the snapshot arrives
+        self.early = []      # deltas that arrived before the snapshot
+
+    def apply_snapshot(self, snapshot):
+        self.levels["BUY"] = {price: quantity for price, quantity in snapshot["bids"]}
+        self.levels["SELL"] = {price: quantity for price, quantity in snapshot["asks"]}
+        self.seq = snapshot["seq"]
+        for delta in self.early:
+            self.apply_delta(delta)
+        self.early = []
+
+    def apply_delta(self, delta):
+        if self.seq is None:
+            self.early.append(delta)
+            return
+        if delta["seq"] <= self.seq:
+            return  # already in the snapshot
+        if delta["seq"] != self.seq + 1:
+            print(f"⚠️ Missed market data {self.seq + 1}..{delta['seq'] - 1}")
+        self.seq = delta["seq"]
+        for level in delta["levels"]:
+            side = self.levels[level["side"]]
+            if level["quantity"]:
+                side[level["price"]] = level["quantity"]
+            else:
+                side.pop(level["price"], None)
+
+    def top(self, side, depth):
+        return sorted(self.levels[side].items(), reverse=(side == "BUY"))[:depth]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Watch a symbol's order book depth")
+    parser.add_argument("symbol", help="Stock symbol (e.g., XYZ)")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help=f"Levels to show (default: {DEFAULT_DEPTH})")
+    parser.add_argument("--host", default="localhost", help="RabbitMQ host")
+    parser.add_argument("--port", type=int, default=5672, help="RabbitMQ port")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    symbol = args.symbol.upper()
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=args.host, port=args.port))
+    channel = connection.channel()
+    channel.exchange_declare(exchange="orders", exchange_type="fanout")
+    channel.exchange_declare(exchange="marketdata", exchange_type="topic")
+
+    # Bind before asking for the snapshot so no delta falls in between
+    result = channel.queue_declare(queue='', exclusive=True)
+    queue_name = result.method.queue
+    channel.queue_bind(exchange="marketdata", queue=queue_name, routing_key=symbol)
+
+    book = LocalBook()
+
+    def show():
+        print(f"\n📖 {symbol} (seq {book.seq})")
+        for price, quantity in reversed(book.top("SELL", args.depth)):
+            print(f"          {price:>10.2f}  {quantity:>8}")
+        for price, quantity in book.top("BUY", args.depth):
+            print(f"{quantity:>8}  {price:>10.2f}")
+
+    def callback(ch, method, properties, body):
+        message = json.loads(body.decode())
+        if "levels" in message:
+            book.apply_delta(message)
+        else:
+            book.apply_snapshot(message)
+        if book.seq is not None:
+            show()
+
+    channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
+    channel.basic_publish(
+        exchange="orders",
+        routing_key=symbol,
+        properties=pika.BasicProperties(reply_to=queue_name, content_type="application/json"),
+        body=json.dumps({"type": "SNAPSHOT", "symbol": symbol, "depth": args.depth}).encode()
+    )
+    print(f"📡 Subscribed to {symbol} depth. Waiting for snapshot...")
+    channel.start_consuming()
+
+
+if __name__ == "__main__":
+    main()
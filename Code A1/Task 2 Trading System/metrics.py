@@ -0,0 +1,172 @@
+"""Latency stamps and Prometheus-style metrics for the trading pipeline.
+
+A traced order carries a stamp from send_order.py, and a traced trade
+carries the exchange's stamp plus the stamp of the order that made it:
+
+    "stamp": {"mono_ns": ..., "wall": ..., "seq": ...}
+
+mono_ns is time.monotonic_ns() and wall is time.time() at the moment the
+message was published; seq numbers the sender's messages, so gaps show
+drops. Every process on one host shares the monotonic clock, so latencies
+between them are taken from it. Across hosts, pass --clock wall and keep the
+clocks in sync.
+
+Each component keeps its own counters, gauges and histograms and serves
+them with serve() as Prometheus text on http://127.0.0.1:<port>/metrics.
+Components only record when they were started with --metrics-port, and test
+for that with a single `is not None` per message otherwise.
+"""
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds, from a few microseconds in the matcher to seconds
+# of queueing behind a backlog
+LATENCY_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CLOCKS = ("monotonic", "wall")
+
+
+def make_stamp(seq):
+    return {"mono_ns": time.monotonic_ns(), "wall": time.time(), "seq": seq}
+
+
+def now(clock="monotonic"):
+    """The current time in seconds, on the clock latencies are taken from."""
+    return time.monotonic_ns() / 1e9 if clock == "monotonic" else time.time()
+
+
+def stamp_time(stamp, clock="monotonic"):
+    return stamp["mono_ns"] / 1e9 if clock == "monotonic" else stamp["wall"]
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}  # { label value: count }, None without a label
+
+    def inc(self, amount=1, key=None):
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in list(self.values.items()):
+            labels = {self.label: key} if self.label else None
+            lines.append(f"{self.name}{format_labels(labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """A value read when scraped, so keeping it current costs nothing.
+
+    collect() returns [(labels dict or None, value), ...].
+    """
+
+    def __init__(self, name, help, collect):
+        self.name = name
+        self.help = help
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.collect():
+            lines.append(f"{self.name}{format_labels(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.bounds = list(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def count(self):
+        return sum(self.counts)
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of values."""
+        target = fraction * self.count()
+        seen = 0
+        for bound, count in zip(self.bounds + [float("inf")], self.counts):
+            seen += count
+            if seen >= target and seen:
+                return bound
+        return 0.0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        counts = list(self.counts)
+        cumulative = 0
+        for bound, count in zip(self.bounds + ["+Inf"], counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, label=None):
+        return self.add(Counter(name, help, label))
+
+    def gauge(self, name, help, collect):
+        return self.add(Gauge(name, help, collect))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def serve(registry, port, host="127.0.0.1"):
+    """Serve the registry on a background thread. Scrapes read the metrics
+    while the component keeps updating them, without any locking, so one
+    scrape may catch a histogram mid-update; the next one is consistent."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # no line per scrape
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📈 Metrics on http://{host}:{port}/metrics")
+    return server
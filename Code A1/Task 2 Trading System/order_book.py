@@ -0,0 +1,215 @@
+import heapq
+from collections import deque
+
+
+class BookSide:
+    """One side of an order book: a heap of price levels, each a FIFO queue.
+
+    Cancelled orders are left in their queue as tombstones and skipped when
+    they reach the front, so a cancel never has to search a level. A level
+    whose live quantity drops to zero is emptied straight away and its price
+    dropped the next time it surfaces at the top of the heap. A level holding
+    more tombstones than live orders is compacted, so cancels far from the
+    best price cannot pile up.
+    """
+
+    def __init__(self, side):
+        self.side = side
+        # BUY is a max-heap, so prices are stored negated
+        self.sign = -1 if side == "BUY" else 1
+        self.heap = []    # [sign * price, ...]
+        self.levels = {}  # { price: deque([order, ...]) }
+        self.depth = {}   # { price: live quantity at that level }
+        self.tombstones = {}  # { price: cancelled orders still in that level }
+        # { price: depth before its first change } while market data is on
+        self.changes = None
+
+    def adjust(self, price, quantity):
+        if self.changes is not None and price not in self.changes:
+            self.changes[price] = self.depth.get(price, 0)
+        self.depth[price] += quantity
+
+    def add(self, order):
+        price = order["price"]
+        level = self.levels.get(price)
+        if level is None:
+            level = self.levels[price] = deque()
+            self.depth[price] = 0
+            self.tombstones[price] = 0
+            heapq.heappush(self.heap, self.sign * price)
+        level.append(order)
+        self.adjust(price, order["quantity"])
+
+    def remove(self, order):
+        # Tombstone the order; it is popped lazily by match()
+        order["cancelled"] = True
+        price = order["price"]
+        self.adjust(price, -order["quantity"])
+
+        level = self.levels[price]
+        if self.depth[price] == 0:
+            # Nothing live is left: the whole queue is tombstones
+            level.clear()
+            self.tombstones[price] = 0
+        else:
+            self.tombstones[price] += 1
+            if self.tombstones[price] > len(level) - self.tombstones[price]:
+                self.levels[price] = deque(o for o in level if not o.get("cancelled"))
+                self.tombstones[price] = 0
+
+    def best_price(self):
+        while self.heap:
+            price = self.sign * self.heap[0]
+            if self.depth[price] > 0:
+                return price
+            self.pop_best_level()
+        return None
+
+    def top(self, n):
+        """[(price, quantity), ...] for the best n live levels."""
+        keys = heapq.nsmallest(n, (key for key in self.heap if self.depth[self.sign * key] > 0))
+        return [(self.sign * key, self.depth[self.sign * key]) for key in keys]
+
+    def orders(self):
+        """Live resting orders, best price first and in time priority."""
+        for key in sorted(self.heap):
+            for order in self.levels[self.sign * key]:
+                if not order.get("cancelled"):
+                    yield order
+
+    def pop_best_level(self):
+        price = self.sign * heapq.heappop(self.heap)
+        del self.levels[price]
+        del self.depth[price]
+        del self.tombstones[price]
+
+
+class OrderBook:
+    """Price-time priority order book for a single symbol."""
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.sides = {"BUY": BookSide("BUY"), "SELL": BookSide("SELL")}
+        self.index = {}  # { order_id: resting order }
+
+    def crosses(self, order, resting_price):
+        if order["side"] == "BUY":
+            return order["price"] >= resting_price
+        return order["price"] <= resting_price
+
+    def match(self, order):
+        """Sweep the opposite side level by level, then rest any remainder.
+
+        Resting orders are filled in place: their quantity shrinks, and they
+        leave the book only once fully filled.
+        """
+        side = order["side"]
+        opposite = self.sides["SELL" if side == "BUY" else "BUY"]
+
+        trades = []
+        remaining = order["quantity"]
+
+        while remaining > 0:
+            best = opposite.best_price()
+            if best is None or not self.crosses(order, best):
+                break
+
+            level = opposite.levels[best]
+            while remaining > 0 and level:
+                resting = level[0]
+                if resting.get("cancelled"):
+                    level.popleft()
+                    opposite.tombstones[best] -= 1
+                    continue
+
+                filled = min(remaining, resting["quantity"])
+
+                buy, sell = (order, resting) if side == "BUY" else (resting, order)
+                trades.append({
+                    "symbol": self.symbol,
+                    "price": best,
+                    "buyer": buy["username"],
+                    "seller": sell["username"],
+                    "quantity": filled,
+                    "buy_id": buy["order_id"],
+                    "sell_id": sell["order_id"]
+                })
+
+                remaining -= filled
+                resting["quantity"] -= filled
+                opposite.adjust(best, -filled)
+                if resting["quantity"] == 0:
+                    level.popleft()
+                    del self.index[resting["order_id"]]
+
+            if opposite.depth[best] == 0:
+                opposite.pop_best_level()
+
+        if remaining > 0:
+            order["quantity"] = remaining
+            self.rest(order)
+
+        return trades  # Always return a list
+
+    def rest(self, order):
+        """Put an order on the book without matching it."""
+        self.sides[order["side"]].add(order)
+        self.index[order["order_id"]] = order
+
+    def track_changes(self):
+        for side in self.sides.values():
+            if side.changes is None:
+                side.changes = {}
+
+    def take_changes(self):
+        """Levels whose depth changed since the last call.
+
+        Returns [(side, price, depth before, depth after), ...]. Only works
+        after track_changes().
+        """
+        changes = []
+        for name, side in self.sides.items():
+            for price, before in side.changes.items():
+                after = side.depth.get(price, 0)
+                if after != before:
+                    changes.append((name, price, before, after))
+            side.changes.clear()
+        return changes
+
+    def resting_orders(self):
+        return [order for side in self.sides.values() for order in side.orders()]
+
+    def cancel(self, order_id):
+        """Remove a resting order in O(1). Returns it, or None if not resting."""
+        order = self.index.pop(order_id, None)
+        if order is not None:
+            self.sides[order["side"]].remove(order)
+        return order
+
+    def amend(self, order_id, price=None, quantity=None):
+        """Change a resting order's price and/or quantity.
+
+        Shrinking the quantity keeps the order's place in the queue. Any other
+        change loses time priority: the order is cancelled and resubmitted,
+        and may trade straight away. Returns (order, trades); order is None if
+        the ID is not resting.
+        """
+        order = self.index.get(order_id)
+        if order is None:
+            return None, []
+
+        price = order["price"] if price is None else price
+        quantity = order["quantity"] if quantity is None else quantity
+
+        if quantity <= 0:
+            return self.cancel(order_id), []
+
+        if price == order["price"] and quantity <= order["quantity"]:
+            self.sides[order["side"]].adjust(price, quantity - order["quantity"])
+            order["quantity"] = quantity
+            return order, []
+
+        self.cancel(order_id)
+        amended = dict(order, price=price, quantity=quantity)
+        del amended["cancelled"]
+        return amended, self.match(amended)
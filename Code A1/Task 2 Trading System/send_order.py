@@ -1,20 +1,210 @@
 import pika
-import json
 import argparse
+import csv
+import json
+import sys
+import time
+import uuid
+import metrics
+import wire
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Send a trading order")
-    parser.add_argument("username", help="Trader name")
-    parser.add_argument("side", choices=["BUY", "SELL"], help="Order side")
-    parser.add_argument("price", type=float, help="Price per share")
+    parser.add_argument("username", nargs="?", help="Trader name")
+    parser.add_argument("side", nargs="?", choices=["BUY", "SELL"], help="Order side")
+    parser.add_argument("price", nargs="?", type=float, help="Price per share")
+    parser.add_argument("--quantity", type=int, default=100, help="Number of shares (default: 100)")
+    parser.add_argument("--cancel", metavar="ORDER_ID", help="Cancel a resting order instead of sending a new one")
     parser.add_argument("--host", default="localhost", help="RabbitMQ host")
     parser.add_argument("--port", type=int, default=5672, help="RabbitMQ port")
     parser.add_argument("--symbol", default="XYZ", help="Stock symbol (e.g., XYZ, ABC)")
-    return parser.parse_args()
+    parser.add_argument("--wire", choices=wire.CONTENT_TYPES, default="json", help="Message format (default: json)")
+    parser.add_argument("--trace", action="store_true",
+                        help="Stamp orders with send times and a sequence number for latency tracing")
+    parser.add_argument("--file", metavar="PATH",
+                        help="Bulk mode: send every order in a CSV or JSON-lines file ('-' for stdin) over one connection")
+    parser.add_argument("--format", choices=["csv", "jsonl"],
+                        help="Format of --file (default: from its extension, else jsonl)")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="Bulk mode: orders per second to aim for (default: 0, as fast as possible)")
+    parser.add_argument("--max-inflight", type=int, default=1000,
+                        help="Bulk mode: most orders awaiting a publisher confirm (default: 1000)")
+    args = parser.parse_args()
+    if args.file is None and args.cancel is None and args.price is None:
+        parser.error("username, side and price are required unless --cancel or --file is given")
+    if args.quantity <= 0:
+        parser.error("--quantity must be a positive number of shares")
+    return args
+
+def read_orders(args):
+    """Yield order messages from the --file, filling in the same defaults as the CLI."""
+    fmt = args.format or ("csv" if args.file.lower().endswith(".csv") else "jsonl")
+    f = sys.stdin if args.file == "-" else open(args.file, newline="")
+    with f:
+        if fmt == "csv":
+            # Header row names the fields, e.g. username,side,price,quantity,symbol
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+
+        for row in rows:
+            message = {key: value for key, value in row.items() if value not in (None, "")}
+            message["type"] = message.get("type", "NEW").upper()
+            message["symbol"] = message.get("symbol", args.symbol).upper()
+            if message["type"] == "NEW":
+                message.setdefault("order_id", uuid.uuid4().hex)
+                message["side"] = message["side"].upper()
+                message["price"] = float(message["price"])
+                message["quantity"] = int(message.get("quantity", args.quantity))
+            else:
+                if "price" in message:
+                    message["price"] = float(message["price"])
+                if "quantity" in message:
+                    message["quantity"] = int(message["quantity"])
+            yield message
+
+class BulkSender:
+    """Streams orders over one connection, with publisher confirms in batches.
+
+    Uses a SelectConnection so publishing never waits on a confirm: up to
+    max_inflight orders are outstanding at once, and the broker confirms
+    them in batches (multiple=True).
+    """
+
+    def __init__(self, args, orders):
+        self.args = args
+        self.orders = orders
+        self.content_type = wire.CONTENT_TYPES[args.wire]
+        # Persistent, so orders waiting in a journaling exchange's durable
+        # queue survive a broker restart
+        self.properties = pika.BasicProperties(content_type=self.content_type, delivery_mode=2)
+
+        self.pending = {}  # { delivery_tag: publish time }, oldest first
+        self.latencies = []
+        self.sent = 0
+        self.nacked = 0
+        self.exhausted = False
+        self.scheduled = False
+
+    def run(self):
+        self.connection = pika.SelectConnection(
+            pika.ConnectionParameters(host=self.args.host, port=self.args.port),
+            on_open_callback=self.on_open,
+            on_open_error_callback=self.on_open_error,
+            on_close_callback=lambda connection, reason: connection.ioloop.stop()
+        )
+        self.connection.ioloop.start()
+
+    def on_open(self, connection):
+        connection.channel(on_open_callback=self.on_channel)
+
+    def on_open_error(self, connection, error):
+        print(f"❌ Could not connect to RabbitMQ: {error}")
+        connection.ioloop.stop()
+
+    def on_channel(self, channel):
+        self.channel = channel
+        channel.exchange_declare(exchange="orders", exchange_type="fanout", callback=self.on_declared)
+
+    def on_declared(self, frame):
+        self.channel.confirm_delivery(ack_nack_callback=self.on_confirm, callback=self.on_confirm_mode)
+
+    def on_confirm_mode(self, frame):
+        self.started = time.perf_counter()
+        self.publish()
+
+    def publish(self):
+        self.scheduled = False
+        now = time.perf_counter()
+
+        budget = self.args.max_inflight - len(self.pending)
+        if self.args.rate:
+            budget = min(budget, int((now - self.started) * self.args.rate) + 1 - self.sent)
+
+        for _ in range(max(budget, 0)):
+            message = next(self.orders, None)
+            if message is None:
+                self.exhausted = True
+                break
+            if self.args.trace:
+                message["stamp"] = metrics.make_stamp(self.sent + 1)
+            properties = self.properties
+            if message["type"] == "AMEND":
+                # An amend sets absolute values, so a journaling exchange
+                # needs its ID to avoid applying a redelivered copy twice
+                properties = pika.BasicProperties(content_type=self.content_type, delivery_mode=2,
+                                                  message_id=uuid.uuid4().hex)
+            self.channel.basic_publish(
+                exchange="orders",
+                routing_key=message["symbol"],
+                properties=properties,
+                body=wire.encode_order(message, self.content_type)
+            )
+            self.sent += 1
+            self.pending[self.sent] = time.perf_counter()
+
+        if self.exhausted:
+            if not self.pending:
+                self.finish()
+        elif len(self.pending) < self.args.max_inflight:
+            # Held back by --rate, not by confirms: come back for the next slice
+            self.schedule(1 / self.args.rate if self.args.rate else 0)
+        # Otherwise the window is full and on_confirm calls publish again
+
+    def schedule(self, delay):
+        if not self.scheduled:
+            self.scheduled = True
+            self.connection.ioloop.call_later(min(delay, 0.01), self.publish)
+
+    def on_confirm(self, frame):
+        method = frame.method
+        now = time.perf_counter()
+        nack = isinstance(method, pika.spec.Basic.Nack)
+
+        if method.multiple:
+            tags = []
+            for tag in self.pending:
+                if tag > method.delivery_tag:
+                    break
+                tags.append(tag)
+        else:
+            tags = [method.delivery_tag]
+
+        for tag in tags:
+            sent_at = self.pending.pop(tag, None)
+            if sent_at is not None:
+                self.latencies.append(now - sent_at)
+                self.nacked += nack
+
+        if self.exhausted and not self.pending:
+            self.finish()
+        elif not self.exhausted:
+            self.schedule(0)
+
+    def finish(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        self.latencies.sort()
+
+        def pct(fraction):
+            if not self.latencies:
+                return 0.0
+            index = min(len(self.latencies) - 1, int(fraction * len(self.latencies)))
+            return self.latencies[index] * 1000
+
+        print(f"✅ Sent {self.sent} orders in {elapsed:.2f}s ({self.sent / elapsed:,.0f} orders/sec)")
+        if self.nacked:
+            print(f"⚠️ {self.nacked} orders were nacked by the broker")
+        print(f"   confirm latency p50 {pct(0.5):.2f}ms  p99 {pct(0.99):.2f}ms  "
+              f"p999 {pct(0.999):.2f}ms  max {pct(1):.2f}ms")
+        self.connection.close()
 
 def main():
     args = parse_args()
 
+    if args.file:
+        BulkSender(args, read_orders(args)).run()
+        return
+
     # Connect to RabbitMQ
     connection = pika.BlockingConnection(pika.ConnectionParameters(host=args.host, port=args.port))
     channel = connection.channel()
@@ -22,24 +212,45 @@ def main():
     # Declare exchange (fanout)
     channel.exchange_declare(exchange="orders", exchange_type="fanout")
 
-    # Build the order message
-    order = {
-        "username": args.username,
-        "side": args.side.upper(),
-        "price": args.price,
-        "quantity": 100,
-        "symbol": args.symbol.upper()
-    }
+    # Build the message
+    if args.cancel:
+        # The symbol tells the exchange which book (and shard) holds the order
+        message = {
+            "type": "CANCEL",
+            "order_id": args.cancel,
+            "username": args.username,
+            "symbol": args.symbol.upper()
+        }
+    else:
+        message = {
+            "type": "NEW",
+            "order_id": uuid.uuid4().hex,
+            "username": args.username,
+            "side": args.side.upper(),
+            "price": args.price,
+            "quantity": args.quantity,
+            "symbol": args.symbol.upper()
+        }
 
 
     # Send the message
+    content_type = wire.CONTENT_TYPES[args.wire]
+    if args.trace:
+        message["stamp"] = metrics.make_stamp(1)
+    # The fanout ignores the routing key, but a sharded exchange uses it to
+    # route the order without decoding it
     channel.basic_publish(
         exchange="orders",
-        routing_key="",
-        body=json.dumps(order).encode()
+        routing_key=message["symbol"],
+        properties=pika.BasicProperties(content_type=content_type, delivery_mode=2),
+        body=wire.encode_order(message, content_type)
     )
 
-    print(f"✅ Sent {order['side']} order at ${order['price']} by {order['username']}")
+    if args.cancel:
+        print(f"🗑️ Sent cancel for order {message['order_id']}")
+    else:
+        print(f"✅ Sent {message['side']} order for {message['quantity']} shares at ${message['price']} by {message['username']}")
+        print(f"🆔 Order ID: {message['order_id']}")
     connection.close()
 
 if __name__ == "__main__":
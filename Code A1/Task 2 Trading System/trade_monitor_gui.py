@@ -1,14 +1,62 @@
 import tkinter as tk
+import argparse
 import pika
+import queue
 import threading
-import json
+import time
+import metrics
+import wire
+from bars import BarAggregator, DEFAULT_WINDOWS
+
+FRAME_RATE = 20  # redraws per second
+BAR_WINDOW = 60  # which bar window the labels show, in seconds
+
+class MonitorStats:
+    """The monitor's counters and latency histograms (metrics.py)."""
+
+    def __init__(self, trade_queue, clock="monotonic"):
+        self.clock = clock
+        self.registry = metrics.Registry()
+        self.trades = self.registry.counter("monitor_trades_total", "Trades received")
+        self.conflated = self.registry.counter("monitor_conflated_total", "Trades superseded before being drawn")
+        self.queue_wait = self.registry.histogram(
+            "monitor_queue_wait_seconds", "From a stamped trade being published to the monitor receiving it")
+        self.end_to_end = self.registry.histogram(
+            "monitor_order_to_trade_seconds", "From a stamped order being sent to the monitor receiving its trade")
+        self.decode = self.registry.histogram("monitor_decode_seconds", "Decoding a trade message")
+        self.render = self.registry.histogram("monitor_render_seconds", "Drawing one frame")
+        self.registry.gauge("monitor_pending_messages", "Trade messages waiting for the next frame",
+                            lambda: [(None, trade_queue.qsize())])
+
+    def received(self, trades, received):
+        self.trades.inc(len(trades))
+        for trade in trades:
+            if "stamp" in trade:
+                self.queue_wait.observe(received - metrics.stamp_time(trade["stamp"], self.clock))
+            if "order_stamp" in trade:
+                self.end_to_end.observe(received - metrics.stamp_time(trade["order_stamp"], self.clock))
 
 class TradeMonitor:
-    def __init__(self, root, host="localhost", port=5672):
+    def __init__(self, root, host="localhost", port=5672, frame_rate=FRAME_RATE,
+                 windows=DEFAULT_WINDOWS, bar_window=BAR_WINDOW, metrics_port=0, clock="monotonic"):
         self.root = root
         self.root.title("📊 Stock Trade Monitor")
         self.labels = {}
 
+        # Every trade feeds the bars, even ones conflated out of the display
+        self.bars = BarAggregator(windows)
+        self.bar_window = bar_window
+
+        # The consumer thread only touches this queue; the Tk thread drains it
+        self.trade_queue = queue.SimpleQueue()
+        self.frame_ms = int(1000 / frame_rate)
+        self.conflated = 0
+
+        self.stats = None
+        if metrics_port:
+            self.stats = MonitorStats(self.trade_queue, clock)
+            metrics.serve(self.stats.registry, metrics_port)
+
         # Header
         header = tk.Label(root, text="📊 Latest Prices", font=("Helvetica", 16, "bold"))
         header.pack(pady=10)
@@ -17,6 +65,10 @@ class TradeMonitor:
         self.stock_frame = tk.Frame(root)
         self.stock_frame.pack(padx=20, pady=10)
 
+        # Trades that were superseded by a newer price before being drawn
+        self.conflated_label = tk.Label(root, text="Conflated updates: 0", font=("Helvetica", 10), fg="gray")
+        self.conflated_label.pack(pady=(0, 10))
+
         # RabbitMQ setup
         self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=host, port=port))
         self.channel = self.connection.channel()
@@ -29,32 +81,80 @@ class TradeMonitor:
 
         # Start listener thread
         threading.Thread(target=self.start_consuming, args=(queue_name,), daemon=True).start()
+        self.root.after(self.frame_ms, self.render)
 
     def start_consuming(self, queue_name):
         def callback(ch, method, properties, body):
-            trade = json.loads(body.decode())
-            print(f"📥 Received trade: {trade}")
-            symbol = trade["symbol"]
-            price = trade["price"]
-            self.update_price(symbol, price)
+            # A batching exchange publishes several trades per message
+            if self.stats is None:
+                self.trade_queue.put(wire.decode_trades(body, properties.content_type))
+                return
+            received = metrics.now(self.stats.clock)
+            started = time.perf_counter()
+            trades = wire.decode_trades(body, properties.content_type)
+            self.stats.decode.observe(time.perf_counter() - started)
+            self.stats.received(trades, received)
+            self.trade_queue.put(trades)
 
         self.channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
         self.channel.start_consuming()
 
+    def render(self):
+        # Drain whatever arrived since the last frame, keeping only the
+        # latest price per symbol, then redraw just the symbols that traded
+        started = time.perf_counter()
+        latest = {}
+        received = 0
+        for _ in range(self.trade_queue.qsize()):
+            for trade in self.trade_queue.get_nowait():
+                self.bars.add_trade(trade)
+                latest[trade["symbol"]] = trade["price"]
+                received += 1
+
+        for symbol, price in latest.items():
+            self.update_price(symbol, price)
+
+        if received > len(latest):
+            self.conflated += received - len(latest)
+            self.conflated_label.config(text=f"Conflated updates: {self.conflated}")
+            if self.stats is not None:
+                self.stats.conflated.inc(received - len(latest))
+
+        if self.stats is not None and received:
+            self.stats.render.observe(time.perf_counter() - started)
+        self.root.after(self.frame_ms, self.render)
+
     def update_price(self, symbol, price):
+        text = f"{symbol}: ${price:.2f}"
+        bar = self.bars.latest(symbol, self.bar_window) if self.bar_window in self.bars.windows else None
+        if bar:
+            text += (f"    {self.bar_window}s  O {bar['open']:.2f}  H {bar['high']:.2f}  L {bar['low']:.2f}"
+                     f"  V {bar['volume']}  VWAP {bar['vwap']:.2f}")
+
         if symbol not in self.labels:
             # Create a new label for the stock
-            label = tk.Label(self.stock_frame, text=f"{symbol}: ${price:.2f}", font=("Helvetica", 14))
+            label = tk.Label(self.stock_frame, text=text, font=("Helvetica", 14))
             label.pack(anchor='w')
             self.labels[symbol] = label
         else:
             # Update the label
-            self.labels[symbol].config(text=f"{symbol}: ${price:.2f}")
+            self.labels[symbol].config(text=text)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Show the latest trade prices")
+    parser.add_argument("--host", default="localhost", help="RabbitMQ host")
+    parser.add_argument("--port", type=int, default=5672, help="RabbitMQ port")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="Serve Prometheus metrics on this local port (default: 0, off)")
+    parser.add_argument("--clock", choices=metrics.CLOCKS, default="monotonic",
+                        help="Clock for latencies from other processes; wall across hosts (default: monotonic)")
+    return parser.parse_args()
 
-def launch_gui():
+def launch_gui(host="localhost", port=5672, metrics_port=0, clock="monotonic"):
     root = tk.Tk()
-    app = TradeMonitor(root)
+    app = TradeMonitor(root, host, port, metrics_port=metrics_port, clock=clock)
     root.mainloop()
 
 if __name__ == "__main__":
-    launch_gui()
+    args = parse_args()
+    launch_gui(args.host, args.port, args.metrics_port, args.clock)
@@ -0,0 +1,190 @@
+"""Wire formats for order and trade messages.
+
+The format is picked by the message's content_type property, so JSON and
+binary clients can share the same exchanges. Messages without a content_type
+are JSON, which is what older clients send.
+
+Binary layout (little-endian), version 1:
+    header: version u8, kind u8
+    NEW:    side u8, price f64, quantity u32, order_id, username, symbol
+    CANCEL: order_id, username, symbol
+    AMEND:  flags u8 (1 = price set, 2 = quantity set), price f64,
+            quantity u32, order_id, symbol
+    TRADES: count u32, then per trade:
+            price f64, quantity u32, symbol, buyer, seller, buy_id, sell_id
+Strings are a u8 byte length followed by UTF-8 bytes.
+
+Version 2 adds the latency stamps of metrics.py, each mono_ns i64, wall f64,
+seq u64. An order has one straight after the header. A trade is followed by
+flags u8 (1 = stamp, 2 = order_stamp) and the stamps it has. Messages
+without stamps are still written as version 1, so tracing costs nothing on
+the wire when it is off.
+"""
+
+import json
+import struct
+
+JSON = "application/json"
+BINARY = "application/x-pbt-binary"
+
+CONTENT_TYPES = {"json": JSON, "binary": BINARY}
+
+VERSION = 1
+STAMPED = 2
+
+KINDS = {"NEW": 1, "CANCEL": 2, "AMEND": 3}
+KIND_NAMES = {kind: name for name, kind in KINDS.items()}
+TRADES = 4
+
+SIDES = {"BUY": 0, "SELL": 1}
+SIDE_NAMES = ("BUY", "SELL")
+
+HEADER = struct.Struct("<BB")
+NEW = struct.Struct("<BdI")
+AMEND = struct.Struct("<BdI")
+COUNT = struct.Struct("<I")
+TRADE = struct.Struct("<dI")
+TRADE_STRINGS = ("symbol", "buyer", "seller", "buy_id", "sell_id")
+STAMP = struct.Struct("<qdQ")
+FLAG = struct.Struct("<B")
+TRADE_STAMPS = ("stamp", "order_stamp")
+
+
+def pack_str(parts, value):
+    data = (value or "").encode()
+    if len(data) > 255:
+        raise ValueError(f"String too long for the binary format: {value!r}")
+    parts.append(bytes((len(data),)))
+    parts.append(data)
+
+
+def unpack_str(body, offset):
+    length = body[offset]
+    offset += 1
+    return body[offset:offset + length].decode(), offset + length
+
+
+def pack_stamp(parts, stamp):
+    parts.append(STAMP.pack(stamp["mono_ns"], stamp["wall"], stamp["seq"]))
+
+
+def unpack_stamp(body, offset):
+    mono_ns, wall, seq = STAMP.unpack_from(body, offset)
+    return {"mono_ns": mono_ns, "wall": wall, "seq": seq}, offset + STAMP.size
+
+
+def is_binary(content_type):
+    return content_type == BINARY
+
+
+def encode_order(message, content_type=JSON):
+    if not is_binary(content_type):
+        return json.dumps(message).encode()
+
+    kind = message.get("type", "NEW")
+    stamp = message.get("stamp")
+    parts = [HEADER.pack(STAMPED if stamp else VERSION, KINDS[kind])]
+    if stamp:
+        pack_stamp(parts, stamp)
+    if kind == "NEW":
+        parts.append(NEW.pack(SIDES[message["side"]], message["price"], message["quantity"]))
+        pack_str(parts, message["order_id"])
+        pack_str(parts, message["username"])
+    elif kind == "CANCEL":
+        pack_str(parts, message["order_id"])
+        pack_str(parts, message.get("username"))
+    else:
+        price, quantity = message.get("price"), message.get("quantity")
+        flags = (price is not None) | (quantity is not None) << 1
+        parts.append(AMEND.pack(flags, price or 0.0, quantity or 0))
+        pack_str(parts, message["order_id"])
+    pack_str(parts, message["symbol"])
+    return b"".join(parts)
+
+
+def decode_order(body, content_type=JSON):
+    if not is_binary(content_type):
+        return json.loads(body.decode())
+
+    version, kind = HEADER.unpack_from(body)
+    if version not in (VERSION, STAMPED):
+        raise ValueError(f"Unsupported wire format version {version}")
+    offset = HEADER.size
+    kind = KIND_NAMES[kind]
+    message = {"type": kind}
+    if version == STAMPED:
+        message["stamp"], offset = unpack_stamp(body, offset)
+
+    if kind == "NEW":
+        side, price, quantity = NEW.unpack_from(body, offset)
+        offset += NEW.size
+        message["order_id"], offset = unpack_str(body, offset)
+        message["username"], offset = unpack_str(body, offset)
+        message.update(side=SIDE_NAMES[side], price=price, quantity=quantity)
+    elif kind == "CANCEL":
+        message["order_id"], offset = unpack_str(body, offset)
+        message["username"], offset = unpack_str(body, offset)
+    else:
+        flags, price, quantity = AMEND.unpack_from(body, offset)
+        offset += AMEND.size
+        message["order_id"], offset = unpack_str(body, offset)
+        if flags & 1:
+            message["price"] = price
+        if flags & 2:
+            message["quantity"] = quantity
+    message["symbol"], offset = unpack_str(body, offset)
+    return message
+
+
+def encode_trades(trades, content_type=JSON):
+    """Encode one trade dict or a list of them."""
+    if not is_binary(content_type):
+        return json.dumps(trades).encode()
+
+    if isinstance(trades, dict):
+        trades = [trades]
+    stamped = any("stamp" in trade or "order_stamp" in trade for trade in trades)
+    parts = [HEADER.pack(STAMPED if stamped else VERSION, TRADES), COUNT.pack(len(trades))]
+    for trade in trades:
+        parts.append(TRADE.pack(trade["price"], trade["quantity"]))
+        for key in TRADE_STRINGS:
+            pack_str(parts, trade[key])
+        if stamped:
+            stamps = [trade.get(key) for key in TRADE_STAMPS]
+            parts.append(FLAG.pack((stamps[0] is not None) | (stamps[1] is not None) << 1))
+            for stamp in stamps:
+                if stamp is not None:
+                    pack_stamp(parts, stamp)
+    return b"".join(parts)
+
+
+def decode_trades(body, content_type=JSON):
+    """Decode a trade message into a list of trades, batched or not."""
+    if not is_binary(content_type):
+        trades = json.loads(body.decode())
+        return [trades] if isinstance(trades, dict) else trades
+
+    version, kind = HEADER.unpack_from(body)
+    if version not in (VERSION, STAMPED) or kind != TRADES:
+        raise ValueError(f"Not a version {VERSION} or {STAMPED} trade message")
+    offset = HEADER.size
+    (count,) = COUNT.unpack_from(body, offset)
+    offset += COUNT.size
+
+    trades = []
+    for _ in range(count):
+        price, quantity = TRADE.unpack_from(body, offset)
+        offset += TRADE.size
+        trade = {}
+        for key in TRADE_STRINGS:
+            trade[key], offset = unpack_str(body, offset)
+        trade["price"] = price
+        trade["quantity"] = quantity
+        if version == STAMPED:
+            (flags,) = FLAG.unpack_from(body, offset)
+            offset += FLAG.size
+            for bit, key in enumerate(TRADE_STAMPS):
+                if flags & (1 << bit):
+                    trade[key], offset = unpack_stamp(body, offset)
+        trades.append(trade)
+    return trades
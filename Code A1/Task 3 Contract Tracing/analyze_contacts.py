@@ -0,0 +1,274 @@
+"""Compute contact history offline from a captured position log.
+
+Reads a log written by position_log.py and writes a contact store directory
+(people.txt and contacts-*.seg) that ContactStore, and so the tracker, loads
+as if the tracker had seen the stream live. Use it to backfill history, or
+with --compare to check a live tracker's store against the same movements.
+
+Time is cut into ticks of --tick seconds. A position holds from the tick it
+was received until the person's next position, or for at most --hold
+seconds, after which they count as gone. Everyone's (tick, cell) is then
+grouped with NumPy: rows sharing one are in contact. A run of consecutive
+ticks in which a pair shares one cell is one meeting, and meetings are cut
+at segment boundaries, as the tracker cuts them.
+
+The live tracker also counts people who overlap only between two moves of
+the same tick (one arriving before the other has left). Working from whole
+ticks, this does not, so --compare shows those pairs as missing here.
+
+The log is read a chunk of ticks at a time, so memory follows the chunk
+size rather than the length of the log.
+"""
+
+import argparse
+import math
+import os
+import time
+import numpy as np
+from contact_store import ContactStore, Segment, segment_name, DEFAULT_SEGMENT, PEOPLE
+from position_log import read_blocks, POSITION_DTYPE
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compute contacts from a captured position log")
+    parser.add_argument("log", help="Position log written by position_log.py")
+    parser.add_argument("output", help="Contact store directory to write segments into")
+    parser.add_argument("--tick", type=float, default=1.0, help="Seconds per tick (default: 1)")
+    parser.add_argument("--hold", type=float, default=60.0,
+                        help="Seconds a position holds without a newer one (default: 60)")
+    parser.add_argument("--segment-minutes", type=float, default=DEFAULT_SEGMENT / 60,
+                        help="Minutes of contacts per segment; match the tracker's (default: 60)")
+    parser.add_argument("--chunk-seconds", type=float, default=60.0,
+                        help="Seconds of positions grouped at a time (default: 60)")
+    parser.add_argument("--compare", metavar="DIR", help="Compare the result with another contact store")
+    args = parser.parse_args()
+
+    segment_ticks = args.segment_minutes * 60 / args.tick
+    if segment_ticks != int(segment_ticks):
+        parser.error("--segment-minutes must be a whole number of ticks")
+    args.segment_ticks = int(segment_ticks)
+    # Chunks have to divide segments evenly, so no chunk straddles two
+    parts = max(1, math.ceil(args.segment_ticks / max(1, args.chunk_seconds / args.tick)))
+    while args.segment_ticks % parts:
+        parts += 1
+    args.chunk_ticks = args.segment_ticks // parts
+    args.hold_ticks = max(1, round(args.hold / args.tick))
+    return args
+
+
+def merge_runs(lo, hi, x, y, first, last):
+    """Join rows of the same pair and cell whose tick ranges follow on from
+    each other. Returns the merged (lo, hi, x, y, first, last)."""
+    if not len(lo):
+        return lo, hi, x, y, first, last
+    # One int64 key sorts much faster than lexsort over three columns
+    people = int(hi.max()) + 1
+    span = int(first.max() - first.min()) + 1
+    if people * people * span < 2 ** 62:
+        order = np.argsort((lo * people + hi) * span + (first - first.min()))
+    else:
+        order = np.lexsort((first, hi, lo))
+    lo, hi, x, y, first, last = (column[order] for column in (lo, hi, x, y, first, last))
+
+    starts = np.ones(len(lo), dtype=bool)
+    starts[1:] = ((lo[1:] != lo[:-1]) | (hi[1:] != hi[:-1]) | (first[1:] != last[:-1] + 1)
+                  | (x[1:] != x[:-1]) | (y[1:] != y[:-1]))
+    index = np.flatnonzero(starts)
+    return lo[index], hi[index], x[index], y[index], first[index], np.maximum.reduceat(last, index)
+
+
+class Analyzer:
+    def __init__(self, args):
+        self.args = args
+        self.names = []        # log person number -> name
+        self.ids = {}          # name -> person number in the output store
+        self.mapping = np.zeros(0, dtype=np.int64)  # log person number -> output store number
+        self.people_file = None
+        self.carry = None      # positions still holding at the end of the last chunk
+        self.segment = None    # start tick of the segment being collected
+        self.runs = []         # meetings found so far in that segment, per chunk
+        self.meetings = 0
+        self.positions = 0
+
+    def open_output(self):
+        os.makedirs(self.args.output, exist_ok=True)
+        people = os.path.join(self.args.output, PEOPLE)
+        # Backfilling into an existing store keeps its person numbers
+        if os.path.exists(people):
+            with open(people) as f:
+                for line in f:
+                    self.ids[line.rstrip("\n")] = len(self.ids)
+        self.people_file = open(people, "a")
+
+    def chunks(self):
+        """Yield (chunk number, [(tick, positions), ...]) for every chunk
+        with positions in it."""
+        chunk_ticks = self.args.chunk_ticks
+        current, parts = None, []
+        for kind, value in read_blocks(self.args.log):
+            if kind == "N":
+                self.names.append(value)
+                continue
+            ts, body = value
+            tick = int(ts // self.args.tick)
+            if current is None:
+                current = tick // chunk_ticks
+            elif tick // chunk_ticks > current:
+                yield current, parts
+                current, parts = tick // chunk_ticks, []
+            # A clock that stepped back stays in the current chunk
+            parts.append((max(tick, current * chunk_ticks), np.frombuffer(body, dtype=POSITION_DTYPE)))
+        if parts:
+            yield current, parts
+
+    def run(self):
+        self.open_output()
+        previous = None
+        for chunk, parts in self.chunks():
+            # Positions held over a gap in the log still meet each other
+            if previous is not None:
+                last_held = previous + 1 + self.args.hold_ticks // self.args.chunk_ticks
+                for skipped in range(previous + 1, min(chunk, last_held + 1)):
+                    self.process(skipped, [])
+            self.process(chunk, parts)
+            previous = chunk
+        if self.segment is not None:
+            self.write_segment()
+        self.people_file.close()
+
+    def process(self, chunk, parts):
+        c0 = chunk * self.args.chunk_ticks
+        c1 = c0 + self.args.chunk_ticks
+        segment = c0 // self.args.segment_ticks * self.args.segment_ticks
+        if self.segment is not None and segment != self.segment:
+            self.write_segment()
+        self.segment = segment
+
+        # Positions carried in from the last chunk go first, so a new position
+        # in the chunk's first tick replaces them
+        records = np.concatenate([r for _, r in parts]) if parts else np.zeros(0, dtype=POSITION_DTYPE)
+        tick = np.concatenate([np.full(len(r), t, dtype=np.int64) for t, r in parts]) if parts else np.zeros(0, np.int64)
+        person, x, y = (records[field].astype(np.int64) for field in ("person", "x", "y"))
+        until = tick + self.args.hold_ticks
+        self.positions += len(person)
+
+        if self.carry is not None:
+            cp, cx, cy, cu = self.carry
+            keep = cu > c0
+            person = np.concatenate([cp[keep], person])
+            x = np.concatenate([cx[keep], x])
+            y = np.concatenate([cy[keep], y])
+            tick = np.concatenate([np.full(keep.sum(), c0, dtype=np.int64), tick])
+            until = np.concatenate([cu[keep], until])
+        if not len(person):
+            self.carry = None
+            return
+
+        # Each person's latest position per tick, in (person, tick) order
+        order = np.argsort(person * (c1 - c0) + (tick - c0), kind="stable")
+        person, x, y, tick, until = (column[order] for column in (person, x, y, tick, until))
+        latest = np.ones(len(person), dtype=bool)
+        latest[:-1] = (person[1:] != person[:-1]) | (tick[1:] != tick[:-1])
+        person, x, y, tick, until = (column[latest] for column in (person, x, y, tick, until))
+
+        # A position holds until the person's next one, its hold runs out, or the chunk ends
+        same = np.zeros(len(person), dtype=bool)
+        same[:-1] = person[1:] == person[:-1]
+        following = np.full(len(person), c1, dtype=np.int64)
+        following[:-1] = np.where(same[:-1], tick[1:], c1)
+        end = np.minimum(np.minimum(following, until), c1)
+        open_ended = ~same & (until > c1)
+        self.carry = (person[open_ended], x[open_ended], y[open_ended], until[open_ended])
+
+        # One row per person per tick they hold a position
+        lengths = end - tick
+        row = np.repeat(np.arange(len(person)), lengths)
+        offset = np.arange(len(row)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        person, x, y, tick = person[row], x[row], y[row], tick[row] + offset
+
+        # Group rows by (tick, cell)
+        width = int(x.max() - x.min()) + 1
+        height = int(y.max() - y.min()) + 1
+        key = ((tick - c0) * width + (x - x.min())) * height + (y - y.min())
+        order = np.argsort(key, kind="stable")
+        key, person, x, y, tick = key[order], person[order], x[order], y[order], tick[order]
+
+        starts = np.ones(len(key), dtype=bool)
+        starts[1:] = key[1:] != key[:-1]
+        group_start = np.maximum.accumulate(np.where(starts, np.arange(len(key)), 0))
+        sizes = np.diff(np.append(np.flatnonzero(starts), len(key)))
+        size = np.repeat(sizes, sizes)
+
+        # Every pair within a group: row i pairs with the rows after it
+        later = size - 1 - (np.arange(len(key)) - group_start)
+        i = np.repeat(np.arange(len(key)), later)
+        j = i + 1 + np.arange(len(i)) - np.repeat(np.cumsum(later) - later, later)
+        a, b = person[i], person[j]
+        lo, hi = np.minimum(a, b), np.maximum(a, b)
+
+        self.runs.append(merge_runs(lo, hi, x[i], y[i], tick[i], tick[i]))
+
+    def write_segment(self):
+        runs = [np.concatenate(column) for column in zip(*self.runs)] if self.runs else None
+        self.runs = []
+        if runs is None or not len(runs[0]):
+            return
+        lo, hi, x, y, first, last = merge_runs(*runs)
+
+        # Log person numbers to the output store's
+        added = []
+        for name in self.names[len(self.mapping):]:
+            if name not in self.ids:
+                self.ids[name] = len(self.ids)
+                self.people_file.write(name + "\n")
+            added.append(self.ids[name])
+        self.people_file.flush()
+        self.mapping = np.append(self.mapping, np.array(added, dtype=np.int64))
+        lo, hi = self.mapping[lo], self.mapping[hi]
+        lo, hi = np.minimum(lo, hi), np.maximum(lo, hi)
+
+        start = self.segment * self.args.tick
+        path = os.path.join(self.args.output, segment_name(start))
+        if os.path.exists(path):
+            print(f"⚠️ {path} already exists; leaving it alone")
+            return
+
+        segment = Segment(start)
+        for column, values in zip(segment.columns(), (lo, hi, x, y, first * self.args.tick, last * self.args.tick)):
+            column.frombytes(values.astype(np.float64 if column.typecode == "d" else np.intc).tobytes())
+        segment.save(path)
+        self.meetings += len(lo)
+        print(f"💾 {segment_name(start)}: {len(lo)} meetings")
+
+
+def store_pairs(directory):
+    store = ContactStore(directory, retention=float("inf"))
+    return {tuple(sorted((store.names[a], store.names[b])))
+            for a, others in store.graph.items() for b in others}
+
+
+def compare(output, other):
+    mine, theirs = store_pairs(output), store_pairs(other)
+    print(f"🔎 {len(mine & theirs)} pairs in both, {len(mine - theirs)} only here, {len(theirs - mine)} only in {other}")
+    for label, pairs in (("only here", mine - theirs), (f"only in {other}", theirs - mine)):
+        for a, b in sorted(pairs)[:10]:
+            print(f"   {label}: {a} - {b}")
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+
+    analyzer = Analyzer(args)
+    analyzer.run()
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ {analyzer.positions} positions from {len(analyzer.names)} people, "
+          f"{analyzer.meetings} meetings in {elapsed:.1f}s")
+
+    if args.compare:
+        compare(args.output, args.compare)
+
+
+if __name__ == "__main__":
+    main()
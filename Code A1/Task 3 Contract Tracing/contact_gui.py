@@ -1,27 +1,51 @@
 import tkinter as tk
 from tkinter import messagebox
+import argparse
+import math
 import pika
 import threading
 import json
+import queue
+import uuid
+from collections import defaultdict
 
 DEFAULT_GRID_SIZE = 10
 DEFAULT_CELL_SIZE = 50
+FRAME_RATE = 20  # redraws per second
+
+# Large-grid mode
+LARGE_GRID = 50        # bigger grids open in large-grid mode
+VIEWPORT = 800         # canvas size in pixels
+MAX_ZOOM = 80          # largest cell, in pixels
+ZOOM_STEP = 1.25
+HEATMAP_BELOW = 8      # cells smaller than this many pixels show a density heatmap
+GRID_LINES_FROM = 4    # cells smaller than this many pixels get no grid lines
+LABELS_FROM = 30       # cells smaller than this many pixels get no name labels
+HEATMAP_BIN = 4        # heatmap resolution, in pixels per bin
+HEATMAP_COLOURS = ["#ffffff"] + [f"#ff{255 - 255 * i // 15:02x}{255 - 255 * i // 15:02x}" for i in range(1, 16)]
 
 class ContactTracerGUI:
-    def __init__(self, root, host="localhost", grid_size=DEFAULT_GRID_SIZE):
+    def __init__(self, root, host="localhost", grid_size=DEFAULT_GRID_SIZE, frame_rate=FRAME_RATE):
         self.root = root
+        self.frame_ms = max(1, int(1000 / frame_rate))
         self.grid_size = grid_size
         self.cell_size = DEFAULT_CELL_SIZE if grid_size <= 20 else 30  # shrink if too large
-        width = grid_size * self.cell_size
-        height = grid_size * self.cell_size
+        size = self.view_size()
 
         self.root.title(f"Contact Tracing Grid ({grid_size}x{grid_size})")
-        self.canvas = tk.Canvas(root, width=width, height=height)
+        self.canvas = tk.Canvas(root, width=size, height=size)
         self.canvas.pack()
         
-        self.person_icons = {}
-        self.positions = {}
-        self.icon_ids = {}
+        self.person_icons = {}  # { person_id: (oval, label) }, reused as they move
+        self.positions = {}  # { person_id: (x, y) }
+        self.cells = defaultdict(set)  # { (x, y): {person_id, ...} }, kept in step with positions
+        self.colours = {}  # { person_id: fill last set on their oval }
+        self.icon_ids = {}  # { canvas item: person_id }
+        self.pending_queries = set()  # correlation IDs of queries awaiting a reply
+
+        # The consumer threads only touch these queues; the Tk thread drains them
+        self.position_queue = queue.SimpleQueue()
+        self.response_queue = queue.SimpleQueue()
 
         self.draw_grid()
 
@@ -37,20 +61,23 @@ class ContactTracerGUI:
 
         self.channel_pos.exchange_declare(exchange="position", exchange_type="fanout")
         self.channel_query.exchange_declare(exchange="query", exchange_type="fanout")
-        self.channel_resp.exchange_declare(exchange="query-response", exchange_type="fanout")
 
         pos_result = self.channel_pos.queue_declare(queue='', exclusive=True)
         self.queue_pos = pos_result.method.queue
         self.channel_pos.queue_bind(exchange="position", queue=self.queue_pos)
 
+        # The tracker replies straight to this queue (reply_to), so it needs no binding
         resp_result = self.channel_resp.queue_declare(queue='', exclusive=True)
         self.queue_resp = resp_result.method.queue
-        self.channel_resp.queue_bind(exchange="query-response", queue=self.queue_resp)
 
         self.canvas.bind("<Button-1>", self.on_click)
 
         threading.Thread(target=self.listen_positions, daemon=True).start()
         threading.Thread(target=self.listen_responses, daemon=True).start()
+        self.root.after(self.frame_ms, self.render)
+
+    def view_size(self):
+        return self.grid_size * self.cell_size
 
     def draw_grid(self):
         for i in range(self.grid_size):
@@ -64,51 +91,79 @@ class ContactTracerGUI:
     def listen_positions(self):
         def callback(ch, method, properties, body):
             data = json.loads(body.decode())
-            self.update_person(data["id"], data["x"], data["y"])
+            # A swarm sends a list of positions per message
+            self.position_queue.put(data if isinstance(data, list) else [data])
         self.channel_pos.basic_consume(queue=self.queue_pos, on_message_callback=callback, auto_ack=True)
         self.channel_pos.start_consuming()
 
     def listen_responses(self):
         def callback(ch, method, properties, body):
-            data = json.loads(body.decode())
-            self.show_contacts(data["person"], data["contacts"])
+            if properties.correlation_id not in self.pending_queries:
+                return
+            self.pending_queries.discard(properties.correlation_id)
+            self.response_queue.put(json.loads(body.decode()))
         self.channel_resp.basic_consume(queue=self.queue_resp, on_message_callback=callback, auto_ack=True)
         self.channel_resp.start_consuming()
 
-    def update_person(self, person_id, x, y):
-        # Delete previous icons
-        if person_id in self.person_icons:
-            icon, label = self.person_icons[person_id]
-            self.canvas.delete(icon)
-            self.canvas.delete(label)
-
-        self.positions[person_id] = (x, y)
-        fill = "red" if self.has_contact(x, y, person_id) else "blue"
-
-        # Person circle
-        icon = self.canvas.create_oval(
-            x * self.cell_size + 5, y * self.cell_size + 5,
-            (x + 1) * self.cell_size - 5, (y + 1) * self.cell_size - 20,
-            fill=fill
-        )
+    def render(self):
+        # Apply everything that arrived since the last frame, keeping only
+        # each person's latest position, then recolour just the cells touched
+        latest = {}
+        for _ in range(self.position_queue.qsize()):
+            for position in self.position_queue.get_nowait():
+                latest[position["id"]] = (position["x"], position["y"])
 
-        # Label below icon
-        label = self.canvas.create_text(
-            x * self.cell_size + self.cell_size // 2,
-            y * self.cell_size + self.cell_size - 8,
-            text=person_id,
-            font=("Helvetica", 9)
-        )
+        touched = set()
+        for person_id, (x, y) in latest.items():
+            self.update_person(person_id, x, y, touched)
+        for cell in touched:
+            self.colour_cell(cell)
+
+        for _ in range(self.response_queue.qsize()):
+            data = self.response_queue.get_nowait()
+            self.show_contacts(data["person"], data["contacts"])
+
+        self.root.after(self.frame_ms, self.render)
+
+    def update_person(self, person_id, x, y, touched):
+        cell = (x, y)
+        previous = self.positions.get(person_id)
+        if previous == cell:
+            return
+
+        x0, y0 = x * self.cell_size, y * self.cell_size
+        oval = (x0 + 5, y0 + 5, x0 + self.cell_size - 5, y0 + self.cell_size - 20)
+        label = (x0 + self.cell_size // 2, y0 + self.cell_size - 8)
+
+        if previous is None:
+            icon = self.canvas.create_oval(*oval, fill="blue")
+            text = self.canvas.create_text(*label, text=person_id, font=("Helvetica", 9))
+            self.person_icons[person_id] = (icon, text)
+            self.colours[person_id] = "blue"
+            self.icon_ids[icon] = person_id
+            self.icon_ids[text] = person_id
+        else:
+            # Move the existing items rather than recreate them
+            icon, text = self.person_icons[person_id]
+            self.canvas.coords(icon, *oval)
+            self.canvas.coords(text, *label)
+            occupants = self.cells[previous]
+            occupants.discard(person_id)
+            if not occupants:
+                del self.cells[previous]
+            touched.add(previous)
 
-        self.person_icons[person_id] = (icon, label)
-        self.icon_ids[icon] = person_id
-        self.icon_ids[label] = person_id
+        self.cells[cell].add(person_id)
+        self.positions[person_id] = cell
+        touched.add(cell)
 
-    def has_contact(self, x, y, current_id):
-        for pid, (px, py) in self.positions.items():
-            if pid != current_id and (px, py) == (x, y):
-                return True
-        return False
+    def colour_cell(self, cell):
+        occupants = self.cells.get(cell, ())
+        fill = "red" if len(occupants) > 1 else "blue"
+        for person_id in occupants:
+            if self.colours[person_id] != fill:
+                self.canvas.itemconfig(self.person_icons[person_id][0], fill=fill)
+                self.colours[person_id] = fill
 
     def on_click(self, event):
         x, y = event.x, event.y
@@ -119,9 +174,12 @@ class ContactTracerGUI:
             self.send_query(person_id)
 
     def send_query(self, person_id):
+        correlation_id = str(uuid.uuid4())
+        self.pending_queries.add(correlation_id)
         self.channel_query.basic_publish(
             exchange="query",
             routing_key="",
+            properties=pika.BasicProperties(reply_to=self.queue_resp, correlation_id=correlation_id),
             body=person_id.encode()
         )
 
@@ -132,11 +190,261 @@ class ContactTracerGUI:
             msg = f"{person} has not been in contact with anyone."
         messagebox.showinfo("Contact List", msg)
 
-def launch_gui(grid_size=DEFAULT_GRID_SIZE):
+class LargeGridGUI(ContactTracerGUI):
+    """For grids too big to draw whole. Only the visible part of the grid is
+    drawn, with lines rather than a rectangle per cell. Drag to pan, use
+    the mouse wheel to zoom, and click a person to query them as before.
+    Zoomed out too far to make out people, the view shows how crowded each
+    patch of the grid is instead.
+
+    Nothing here is sized by the grid: canvas items only exist for what is
+    on screen, and positions are kept per person, not per cell.
+    """
+
+    def __init__(self, root, host="localhost", grid_size=DEFAULT_GRID_SIZE, frame_rate=FRAME_RATE):
+        # NumPy is only needed for large grids
+        import numpy as np
+        self.np = np
+
+        # The view: pixels per cell, and the cell at the canvas' top left
+        self.fit_zoom = VIEWPORT / grid_size
+        self.zoom = self.fit_zoom
+        self.origin = [0.0, 0.0]
+        self.dirty = True   # the view changed; redraw everything next frame
+        self.moved = False  # someone moved since the heatmap was drawn
+        self.heatmap_image = None
+        self.drag = None
+
+        # Positions as arrays too, for the heatmap
+        self.index = {}  # { person_id: row in xs/ys }
+        self.xs = np.zeros(1024, dtype=np.int32)
+        self.ys = np.zeros(1024, dtype=np.int32)
+
+        super().__init__(root, host, grid_size, frame_rate)
+
+        self.canvas.config(bg="white")  # matches the heatmap's empty colour
+        self.canvas.bind("<Button-1>", self.on_press)
+        self.canvas.bind("<B1-Motion>", self.on_drag)
+        self.canvas.bind("<ButtonRelease-1>", self.on_release)
+        self.canvas.bind("<MouseWheel>", lambda e: self.zoom_at(e.x, e.y, ZOOM_STEP if e.delta > 0 else 1 / ZOOM_STEP))
+        self.canvas.bind("<Button-4>", lambda e: self.zoom_at(e.x, e.y, ZOOM_STEP))
+        self.canvas.bind("<Button-5>", lambda e: self.zoom_at(e.x, e.y, 1 / ZOOM_STEP))
+
+    def view_size(self):
+        return VIEWPORT
+
+    def draw_grid(self):
+        # Drawn per view in redraw()
+        pass
+
+    def heatmap(self):
+        return self.zoom < HEATMAP_BELOW
+
+    def visible_cells(self):
+        """Range of cells on screen: x0, y0, x1, y1 with x1 and y1 excluded."""
+        span = VIEWPORT / self.zoom
+        x0, y0 = max(0, int(self.origin[0])), max(0, int(self.origin[1]))
+        x1 = min(self.grid_size, math.ceil(self.origin[0] + span))
+        y1 = min(self.grid_size, math.ceil(self.origin[1] + span))
+        return x0, y0, x1, y1
+
+    def is_visible(self, cell):
+        x0, y0, x1, y1 = self.visible_cells()
+        return x0 <= cell[0] < x1 and y0 <= cell[1] < y1
+
+    def cell_box(self, cell):
+        left = (cell[0] - self.origin[0]) * self.zoom
+        top = (cell[1] - self.origin[1]) * self.zoom
+        return left, top
+
+    # --- people ---
+
+    def update_person(self, person_id, x, y, touched):
+        cell = (x, y)
+        previous = self.positions.get(person_id)
+        if previous == cell:
+            return
+
+        if previous is not None:
+            occupants = self.cells[previous]
+            occupants.discard(person_id)
+            if not occupants:
+                del self.cells[previous]
+            touched.add(previous)
+        self.cells[cell].add(person_id)
+        self.positions[person_id] = cell
+        touched.add(cell)
+        self.store_position(person_id, x, y)
+        self.moved = True
+
+        if self.heatmap() or self.dirty:
+            return
+        if self.is_visible(cell):
+            self.draw_person(person_id, cell)
+        else:
+            self.hide_person(person_id)
+
+    def store_position(self, person_id, x, y):
+        row = self.index.get(person_id)
+        if row is None:
+            row = self.index[person_id] = len(self.index)
+            if row == len(self.xs):
+                self.xs = self.np.resize(self.xs, 2 * row)
+                self.ys = self.np.resize(self.ys, 2 * row)
+        self.xs[row] = x
+        self.ys[row] = y
+
+    def draw_person(self, person_id, cell):
+        left, top = self.cell_box(cell)
+        pad = self.zoom * 0.1
+        labelled = self.zoom >= LABELS_FROM
+        oval = (left + pad, top + pad, left + self.zoom - pad,
+                top + self.zoom - (self.zoom * 0.4 if labelled else pad))
+
+        items = self.person_icons.get(person_id)
+        if items is None:
+            fill = "red" if len(self.cells[cell]) > 1 else "blue"
+            icon = self.canvas.create_oval(*oval, fill=fill, tags="person")
+            text = None
+            if labelled:
+                text = self.canvas.create_text(left + self.zoom / 2, top + self.zoom * 0.8, text=person_id,
+                                               font=("Helvetica", 9), tags="person")
+                self.icon_ids[text] = person_id
+            self.person_icons[person_id] = (icon, text)
+            self.colours[person_id] = fill
+            self.icon_ids[icon] = person_id
+        else:
+            icon, text = items
+            self.canvas.coords(icon, *oval)
+            if text is not None:
+                self.canvas.coords(text, left + self.zoom / 2, top + self.zoom * 0.8)
+
+    def hide_person(self, person_id):
+        items = self.person_icons.pop(person_id, None)
+        if items is None:
+            return
+        for item in items:
+            if item is not None:
+                self.canvas.delete(item)
+                del self.icon_ids[item]
+        del self.colours[person_id]
+
+    def colour_cell(self, cell):
+        occupants = self.cells.get(cell, ())
+        fill = "red" if len(occupants) > 1 else "blue"
+        for person_id in occupants:
+            if person_id in self.person_icons and self.colours[person_id] != fill:
+                self.canvas.itemconfig(self.person_icons[person_id][0], fill=fill)
+                self.colours[person_id] = fill
+
+    # --- drawing ---
+
+    def render(self):
+        super().render()
+        if self.dirty or (self.moved and self.heatmap()):
+            self.redraw()
+
+    def redraw(self):
+        self.dirty = False
+        self.moved = False
+        self.canvas.delete("grid", "person", "heat")
+        self.person_icons.clear()
+        self.icon_ids.clear()
+        self.colours.clear()
+        self.heatmap_image = None
+
+        if self.heatmap():
+            self.draw_heatmap()
+        self.draw_grid_lines()
+        if not self.heatmap():
+            x0, y0, x1, y1 = self.visible_cells()
+            for (x, y), occupants in self.cells.items():
+                if x0 <= x < x1 and y0 <= y < y1:
+                    for person_id in occupants:
+                        self.draw_person(person_id, (x, y))
+
+    def draw_grid_lines(self):
+        x0, y0, x1, y1 = self.visible_cells()
+        left, top = self.cell_box((x0, y0))
+        right, bottom = self.cell_box((x1, y1))
+        if self.zoom >= GRID_LINES_FROM:
+            for x in range(x0, x1 + 1):
+                px = (x - self.origin[0]) * self.zoom
+                self.canvas.create_line(px, top, px, bottom, fill="gray", tags="grid")
+            for y in range(y0, y1 + 1):
+                py = (y - self.origin[1]) * self.zoom
+                self.canvas.create_line(left, py, right, py, fill="gray", tags="grid")
+        else:
+            self.canvas.create_rectangle(left, top, right, bottom, outline="gray", tags="grid")
+
+    def draw_heatmap(self):
+        # Count people per bin of the viewport into an occupancy array, then
+        # draw it as one image
+        np = self.np
+        bins = VIEWPORT // HEATMAP_BIN
+        count = len(self.index)
+        bx = ((self.xs[:count] + 0.5 - self.origin[0]) * self.zoom / HEATMAP_BIN).astype(np.int64)
+        by = ((self.ys[:count] + 0.5 - self.origin[1]) * self.zoom / HEATMAP_BIN).astype(np.int64)
+        shown = (bx >= 0) & (bx < bins) & (by >= 0) & (by < bins)
+        occupancy = np.bincount(by[shown] * bins + bx[shown], minlength=bins * bins).reshape(bins, bins)
+
+        peak = occupancy.max()
+        levels = np.ceil(occupancy * (len(HEATMAP_COLOURS) - 1) / peak).astype(np.int64) if peak else occupancy
+        colours = np.array(HEATMAP_COLOURS)[levels]
+        image = tk.PhotoImage(width=bins, height=bins)
+        image.put(" ".join("{" + " ".join(row) + "}" for row in colours.tolist()))
+        self.heatmap_image = image.zoom(HEATMAP_BIN)
+        self.canvas.create_image(0, 0, image=self.heatmap_image, anchor="nw", tags="heat")
+
+    # --- pan and zoom ---
+
+    def on_press(self, event):
+        self.drag = (event.x, event.y, list(self.origin), False)
+
+    def on_drag(self, event):
+        if self.drag is None:
+            return
+        x, y, origin, dragged = self.drag
+        if not dragged and abs(event.x - x) + abs(event.y - y) < 4:
+            return
+        self.drag = (x, y, origin, True)
+        self.origin = [origin[0] - (event.x - x) / self.zoom, origin[1] - (event.y - y) / self.zoom]
+        self.clamp_origin()
+        self.dirty = True
+
+    def on_release(self, event):
+        if self.drag is not None and not self.drag[3]:
+            self.on_click(event)
+        self.drag = None
+
+    def zoom_at(self, px, py, factor):
+        zoom = min(MAX_ZOOM, max(self.fit_zoom, self.zoom * factor))
+        # Keep the cell under the pointer where it is
+        cx, cy = self.origin[0] + px / self.zoom, self.origin[1] + py / self.zoom
+        self.zoom = zoom
+        self.origin = [cx - px / zoom, cy - py / zoom]
+        self.clamp_origin()
+        self.dirty = True
+
+    def clamp_origin(self):
+        span = VIEWPORT / self.zoom
+        for axis in (0, 1):
+            self.origin[axis] = min(max(0.0, self.origin[axis]), max(0.0, self.grid_size - span))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Show people moving on the grid; click one to query their contacts")
+    parser.add_argument("--grid", type=int, default=20, help="Grid size (default: 20x20)")
+    parser.add_argument("--host", default="localhost", help="RabbitMQ host")
+    parser.add_argument("--large", action="store_true",
+                        help=f"Use large-grid mode (viewport, pan, zoom, heatmap) even for grids up to {LARGE_GRID}")
+    return parser.parse_args()
+
+def launch_gui(grid_size=DEFAULT_GRID_SIZE, host="localhost", large=False):
     root = tk.Tk()
-    app = ContactTracerGUI(root, grid_size=grid_size)
+    gui = LargeGridGUI if large or grid_size > LARGE_GRID else ContactTracerGUI
+    app = gui(root, host=host, grid_size=grid_size)
     root.mainloop()
 
 if __name__ == "__main__":
-    # 👇 You can change the grid size here!
-    launch_gui(grid_size=20)
+    args = parse_args()
+    launch_gui(grid_size=args.grid, host=args.host, large=args.large)
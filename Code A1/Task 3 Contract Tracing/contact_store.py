@@ -0,0 +1,354 @@
+"""Time-windowed contact history for the tracker.
+
+A contact event is one meeting: two people sharing a cell, from first_seen
+until one of them moves away. Events go into time segments (an hour each by
+default). Each segment stores its events column by column in typed arrays,
+with people interned to integer IDs, plus a per-person index of its rows. A
+query for one person's contacts in a time range only visits the segments
+that overlap the range, and only that person's rows within them.
+
+Segments are written to disk as they fill (and on flush()), and loaded back
+on startup. Segments older than the retention window are dropped from memory
+and deleted.
+
+Alongside the segments the store keeps a contact graph, updated as events
+are recorded, for transitive exposure queries: for each pair of people who
+met, the [first_seen, last_seen] interval of every meeting, oldest first.
+"""
+
+import bisect
+import os
+import struct
+import time
+from array import array
+
+DEFAULT_RETENTION = 14 * 24 * 3600  # seconds
+DEFAULT_SEGMENT = 3600              # seconds of events per segment
+
+PEOPLE = "people.txt"
+HEADER = struct.Struct("<4sBdI")    # magic, version, segment start, event count
+MAGIC = b"CTSG"
+VERSION = 1
+
+
+def segment_name(start):
+    return f"contacts-{int(start):012d}.seg"
+
+
+def spread(source, depth, since=None):
+    """Time-respecting exposure from source over at most depth hops.
+
+    Bellman-Ford: each round relaxes the meetings of the people whose
+    exposure time improved last round. It is a generator so the meetings can
+    come from anywhere: it yields each round's frontier and is sent back
+    { upstream: { other: [[first, last], ...] } } for it, every list oldest
+    first. Returns { other: (hops, exposed_at, via) }.
+    """
+    exposed = {source: 0 if since is None else since}
+    hops = {}
+    via = {}
+    frontier = {source}
+    for hop in range(1, depth + 1):
+        if not frontier:
+            break
+        graph = yield frontier
+        # Relax from the times the frontier had when the round began: a time
+        # lowered earlier in this same round is one hop further out
+        times = {upstream: exposed[upstream] for upstream in frontier}
+        improved = set()
+        for upstream in frontier:
+            at = times[upstream]
+            for other, meetings in graph.get(upstream, {}).items():
+                for first, last in meetings:
+                    if last >= at:
+                        when = max(first, at)
+                        if when < exposed.get(other, float("inf")):
+                            exposed[other] = when
+                            hops[other] = hop
+                            via[other] = upstream
+                            improved.add(other)
+                        break
+        frontier = improved
+
+    return {other: (hops[other], exposed[other], via[other]) for other in hops if other != source}
+
+
+class Segment:
+    def __init__(self, start):
+        self.start = start
+        self.end = start  # latest last_seen in the segment
+        self.a = array("i")
+        self.b = array("i")
+        self.x = array("i")
+        self.y = array("i")
+        self.first = array("d")
+        self.last = array("d")
+        self.by_person = {}  # { person: array of row numbers }
+
+    def columns(self):
+        return (self.a, self.b, self.x, self.y, self.first, self.last)
+
+    def index(self, person, row):
+        rows = self.by_person.get(person)
+        if rows is None:
+            rows = self.by_person[person] = array("I")
+        rows.append(row)
+
+    def append(self, a, b, cell, ts):
+        row = len(self.a)
+        self.a.append(a)
+        self.b.append(b)
+        self.x.append(cell[0])
+        self.y.append(cell[1])
+        self.first.append(ts)
+        self.last.append(ts)
+        self.index(a, row)
+        self.index(b, row)
+        self.end = max(self.end, ts)
+        return row
+
+    def touch(self, row, ts):
+        self.last[row] = ts
+        self.end = max(self.end, ts)
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.start, len(self.a)))
+            for column in self.columns():
+                column.tofile(f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            magic, version, start, count = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a version {VERSION} contact segment")
+            segment = cls(start)
+            for column in segment.columns():
+                column.fromfile(f, count)
+
+        # The per-person index is rebuilt rather than stored
+        for row in range(count):
+            segment.index(segment.a[row], row)
+            segment.index(segment.b[row], row)
+        segment.end = max(segment.last) if count else start
+        return segment
+
+
+class ContactStore:
+    def __init__(self, directory=None, retention=DEFAULT_RETENTION, segment_seconds=DEFAULT_SEGMENT):
+        self.directory = directory
+        self.retention = retention
+        self.segment_seconds = segment_seconds
+
+        self.names = []   # person number -> name
+        self.ids = {}     # name -> person number
+        self.segments = []  # oldest first; the last one is being written
+        self.starts = []    # segment start times, for bisect
+        self.active = {}    # { (a, b): (row in the current segment, meeting) } for ongoing meetings
+        # { person: { other: [[first, last], ...] } }; both directions share one list
+        self.graph = {}
+        self.people_file = None
+        self.on_expire = None  # called after expire() drops segments, e.g. to clear cached answers
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.load()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        people = self.path(PEOPLE)
+        if os.path.exists(people):
+            with open(people) as f:
+                for line in f:
+                    self.intern(line.rstrip("\n"), persist=False)
+        self.people_file = open(people, "a")
+
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith("contacts-") and name.endswith(".seg"):
+                segment = Segment.load(self.path(name))
+                self.segments.append(segment)
+                self.starts.append(segment.start)
+                for row in range(len(segment.a)):
+                    self.link(segment.a[row], segment.b[row], [segment.first[row], segment.last[row]])
+        self.expire(time.time())
+
+    def intern(self, name, persist=True):
+        number = self.ids.get(name)
+        if number is None:
+            number = self.ids[name] = len(self.names)
+            self.names.append(name)
+            if persist and self.people_file:
+                self.people_file.write(name + "\n")
+                self.people_file.flush()
+        return number
+
+    def link(self, a, b, meeting):
+        meetings = self.graph.setdefault(a, {}).get(b)
+        if meetings is None:
+            meetings = self.graph[a][b] = []
+            self.graph.setdefault(b, {})[a] = meetings
+        meetings.append(meeting)
+
+    def unlink(self, a, b, first):
+        meetings = self.graph[a][b]
+        # Expiry goes oldest first, so the meeting is at the front
+        if meetings and meetings[0][0] == first:
+            meetings.pop(0)
+        if not meetings:
+            del self.graph[a][b]
+            del self.graph[b][a]
+
+    def current(self, ts):
+        """The segment that events at ts go into, starting a new one if due."""
+        start = ts // self.segment_seconds * self.segment_seconds
+        if self.segments and self.segments[-1].start >= start:
+            return self.segments[-1]
+
+        if self.segments:
+            self.save(self.segments[-1])
+        # Ongoing meetings carry on as new events in the new segment
+        self.active.clear()
+        segment = Segment(start)
+        self.segments.append(segment)
+        self.starts.append(start)
+        self.expire(ts)
+        return segment
+
+    def record(self, person, other, cell, ts=None):
+        """Note that person and other share cell at ts. Returns True for a new meeting."""
+        ts = time.time() if ts is None else ts
+        segment = self.current(ts)
+        a, b = self.intern(person), self.intern(other)
+        key = (a, b) if a < b else (b, a)
+
+        ongoing = self.active.get(key)
+        if ongoing is not None:
+            row, meeting = ongoing
+            segment.touch(row, ts)
+            meeting[1] = ts
+            return False
+
+        meeting = [ts, ts]
+        self.link(key[0], key[1], meeting)
+        self.active[key] = (segment.append(key[0], key[1], cell, ts), meeting)
+        return True
+
+    def end(self, person, other):
+        """The meeting between person and other is over."""
+        a, b = self.ids.get(person), self.ids.get(other)
+        if a is not None and b is not None:
+            self.active.pop((a, b) if a < b else (b, a), None)
+
+    def window_start(self, since):
+        """since, moved up to the start of the retention window, so history
+        waiting for expire() to drop it is never returned."""
+        cutoff = time.time() - self.retention
+        return cutoff if since is None else max(since, cutoff)
+
+    def contacts(self, person, since=None, until=None):
+        """Everyone person met between since and until (epoch seconds).
+
+        Returns { other: {"cell": [x, y], "first_seen": t, "last_seen": t} },
+        merging repeat meetings: the cell is where they first met.
+        """
+        number = self.ids.get(person)
+        if number is None:
+            return {}
+        since = self.window_start(since)
+        until = float("inf") if until is None else until
+
+        found = {}
+        # Segments starting after `until` cannot overlap the range
+        for segment in self.segments[:bisect.bisect_right(self.starts, until)]:
+            if segment.end < since:
+                continue
+            for row in segment.by_person.get(number, ()):
+                first, last = segment.first[row], segment.last[row]
+                if last < since or first > until:
+                    continue
+                other = segment.b[row] if segment.a[row] == number else segment.a[row]
+                entry = found.get(other)
+                if entry is None:
+                    found[other] = {"cell": [segment.x[row], segment.y[row]],
+                                    "first_seen": first, "last_seen": last}
+                else:
+                    if first < entry["first_seen"]:
+                        entry.update(cell=[segment.x[row], segment.y[row]], first_seen=first)
+                    entry["last_seen"] = max(entry["last_seen"], last)
+
+        return {self.names[other]: entry for other, entry in found.items()}
+
+    def exposure(self, person, depth, since=None):
+        """Everyone within depth hops of person, with the earliest time each
+        could have been exposed.
+
+        person counts as exposed from since (default: all retained history).
+        A meeting only passes exposure on if it lasted until at least the
+        time the upstream person was exposed, and passes it on no earlier
+        than that. Returns { other: {"hops": n, "exposed_at": t, "via": name} }.
+        """
+        source = self.ids.get(person)
+        if source is None:
+            return {}
+
+        walk = spread(source, depth, self.window_start(since))
+        try:
+            frontier = next(walk)
+            while True:
+                frontier = walk.send({upstream: self.graph.get(upstream, {}) for upstream in frontier})
+        except StopIteration as done:
+            reached = done.value
+
+        return {
+            self.names[other]: {"hops": hops, "exposed_at": at, "via": self.names[via]}
+            for other, (hops, at, via) in reached.items()
+        }
+
+    def meetings(self, person, since=None):
+        """Every retained meeting of person that lasted until since or later,
+        as { other: [[first, last], ...] }, oldest first."""
+        number = self.ids.get(person)
+        if number is None:
+            return {}
+        since = self.window_start(since)
+
+        found = {}
+        for other, meetings in self.graph.get(number, {}).items():
+            kept = [meeting for meeting in meetings if meeting[1] >= since]
+            if kept:
+                found[self.names[other]] = kept
+        return found
+
+    def expire(self, now):
+        """Drop whole segments that ended before the retention window,
+        the one being written included once it has gone quiet that long."""
+        cutoff = now - self.retention
+        dropped = False
+        while self.segments and self.segments[0].end < cutoff:
+            dropped = True
+            segment = self.segments.pop(0)
+            if not self.segments:
+                self.active.clear()  # its rows are gone
+            self.starts.pop(0)
+            for row in range(len(segment.a)):
+                self.unlink(segment.a[row], segment.b[row], segment.first[row])
+            if self.directory:
+                path = self.path(segment_name(segment.start))
+                if os.path.exists(path):
+                    os.remove(path)
+        if dropped and self.on_expire is not None:
+            self.on_expire()
+
+    def save(self, segment):
+        if self.directory:
+            segment.save(self.path(segment_name(segment.start)))
+
+    def flush(self):
+        """Write the segment being filled, so a restart keeps it."""
+        if self.segments:
+            self.save(self.segments[-1])
@@ -3,20 +3,99 @@ import json
 import argparse
 import random
 import time
+import regions
 
 def parse_args():
-    parser = argparse.ArgumentParser(description="Simulated person that moves around a grid")
-    parser.add_argument("id", help="Unique person ID (e.g., alice)")
+    parser = argparse.ArgumentParser(description="Simulated person (or crowd) that moves around a grid")
+    parser.add_argument("id", nargs="?", help="Unique person ID (e.g., alice); with --swarm, a name prefix (default: p)")
     parser.add_argument("--host", default="localhost", help="RabbitMQ host")
-    parser.add_argument("--speed", type=float, default=1.0, help="Moves per second (default: 1)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Moves per second; with --swarm, the target tick rate (default: 1)")
     parser.add_argument("--grid", type=int, default=10, help="Grid size (default: 10x10)")
-    return parser.parse_args()
+    parser.add_argument("--region-size", type=int, default=regions.REGION_SIZE,
+                        help=f"Cells per region side, for sharded trackers (default: {regions.REGION_SIZE})")
+    parser.add_argument("--swarm", type=int, metavar="N", help="Simulate N people in this one process (needs NumPy)")
+    parser.add_argument("--seed", type=int, help="Random seed, for reproducible walks")
+    parser.add_argument("--batch", type=int, default=1000,
+                        help="Most positions per message in swarm mode (default: 1000)")
+    args = parser.parse_args()
+    if args.id is None and not args.swarm:
+        parser.error("a person ID is required unless --swarm is given")
+    return args
 
 def clamp(val, min_val, max_val):
     return max(min_val, min(val, max_val))
 
+def publish_tick(channel, names, x, y, tick, args):
+    # One message per region (so tracker shards get only their own), holding
+    # everyone in it, split into --batch sized chunks
+    import numpy as np
+
+    per_side = (args.grid - 1) // args.region_size + 1
+    region = (x // args.region_size) * per_side + y // args.region_size
+    order = np.argsort(region, kind="stable")
+    starts = np.flatnonzero(np.diff(region[order])) + 1
+    xs, ys = x.tolist(), y.tolist()
+
+    for group in np.split(order, starts):
+        group = group.tolist()
+        key = regions.region_key(xs[group[0]], ys[group[0]], args.region_size)
+        for i in range(0, len(group), args.batch):
+            positions = [{"id": names[p], "x": xs[p], "y": ys[p], "seq": tick} for p in group[i:i + args.batch]]
+            channel.basic_publish(exchange="position", routing_key=key, body=json.dumps(positions).encode())
+
+def run_swarm(args, connection, channel):
+    # NumPy is only needed here, so single-person mode runs without it
+    import numpy as np
+
+    count, grid_size = args.swarm, args.grid
+    prefix = args.id or "p"
+    names = [f"{prefix}{i}" for i in range(count)]
+    interval = 1.0 / args.speed
+
+    rng = np.random.default_rng(args.seed)
+    x = rng.integers(0, grid_size, size=count)
+    y = rng.integers(0, grid_size, size=count)
+
+    print(f"🚶 Swarm of {count} starting on {grid_size}x{grid_size} grid at {args.speed:g} ticks/sec...")
+
+    report_every = max(1, round(args.speed * 10))  # about every 10 seconds
+    tick = 0
+    late = 0  # ticks that fell a whole interval behind
+    next_tick = time.monotonic()
+    while True:
+        started = time.monotonic()
+        publish_tick(channel, names, x, y, tick, args)
+        tick += 1
+        if tick % report_every == 0:
+            print(f"📍 Tick {tick}: published {count} positions in {(time.monotonic() - started) * 1000:.0f}ms"
+                  + (f" ⚠️ {late} ticks ran late" if late else ""))
+            late = 0
+
+        # Everyone takes a king move at once, staying on the grid
+        x = np.clip(x + rng.integers(-1, 2, size=count), 0, grid_size - 1)
+        y = np.clip(y + rng.integers(-1, 2, size=count), 0, grid_size - 1)
+
+        next_tick += interval
+        delay = next_tick - time.monotonic()
+        if delay > 0:
+            connection.sleep(delay)  # keeps the connection's heartbeats going
+        elif -delay > interval:
+            # Too slow for the target rate: carry on from now rather than burst to catch up
+            late += 1
+            next_tick = time.monotonic()
+
 def main():
     args = parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    if args.swarm:
+        connection = pika.BlockingConnection(pika.ConnectionParameters(args.host))
+        channel = connection.channel()
+        channel.exchange_declare(exchange="position", exchange_type="fanout")
+        run_swarm(args, connection, channel)
+        return
+
     person_id = args.id
     delay = 1.0 / args.speed
     grid_size = args.grid
@@ -32,15 +111,22 @@ def main():
 
     print(f"🚶 {person_id} starting at ({x}, {y}) on {grid_size}x{grid_size} grid...")
 
+    seq = 0
     while True:
-        # Publish position
+        # Publish position; seq lets tracker shards order moves across a boundary
         message = {
             "id": person_id,
             "x": x,
-            "y": y
+            "y": y,
+            "seq": seq
         }
+        seq += 1
 
-        channel.basic_publish(exchange="position", routing_key="", body=json.dumps(message).encode())
+        channel.basic_publish(
+            exchange="position",
+            routing_key=regions.region_key(x, y, args.region_size),
+            body=json.dumps(message).encode()
+        )
         print(f"📍 {person_id} moved to ({x}, {y})")
 
         time.sleep(delay)
@@ -0,0 +1,122 @@
+"""Compact on-disk log of the position stream.
+
+Running this file captures the `position` fanout to a log, which
+analyze_contacts.py turns into contact history offline. The log is a header
+followed by blocks, each starting with a type byte:
+
+    N  a new name: u16 length, UTF-8 bytes. Names are numbered from 0 in
+       the order they appear, like the contact store's people.txt.
+    P  one received message: f64 receive time, u32 count, then count
+       positions of u32 person, i32 x, i32 y.
+
+Positions are 12 bytes each, against 40 or so as JSON, and a P block's body
+reads straight into a NumPy array.
+"""
+
+import argparse
+import json
+import struct
+import time
+import pika
+
+MAGIC = b"CTPL"
+VERSION = 1
+HEADER = struct.Struct("<4sB")
+NAME = struct.Struct("<H")
+BLOCK = struct.Struct("<dI")
+POSITION = struct.Struct("<Iii")
+POSITION_DTYPE = [("person", "<u4"), ("x", "<i4"), ("y", "<i4")]
+
+FLUSH_SECONDS = 1
+
+
+class PositionLogWriter:
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION))
+        self.ids = {}     # name -> person number
+        self.count = 0    # positions written
+
+    def person(self, name):
+        number = self.ids.get(name)
+        if number is None:
+            number = self.ids[name] = len(self.ids)
+            encoded = name.encode()
+            self.file.write(b"N" + NAME.pack(len(encoded)) + encoded)
+        return number
+
+    def write(self, ts, positions):
+        records = b"".join(POSITION.pack(self.person(p["id"]), p["x"], p["y"]) for p in positions)
+        self.file.write(b"P" + BLOCK.pack(ts, len(positions)) + records)
+        self.count += len(positions)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_blocks(path):
+    """Yield ("N", name) and ("P", (ts, body bytes)) in file order."""
+    with open(path, "rb") as f:
+        magic, version = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} position log")
+        while True:
+            kind = f.read(1)
+            if not kind:
+                return
+            if kind == b"N":
+                length, = NAME.unpack(f.read(NAME.size))
+                yield "N", f.read(length).decode()
+            elif kind == b"P":
+                ts, count = BLOCK.unpack(f.read(BLOCK.size))
+                yield "P", (ts, f.read(count * POSITION.size))
+            else:
+                raise ValueError(f"{path}: unknown block {kind!r} at byte {f.tell() - 1}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Capture the position stream to a compact log")
+    parser.add_argument("log", help="File to write (overwritten)")
+    parser.add_argument("--host", default="localhost", help="RabbitMQ host")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    log = PositionLogWriter(args.log)
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters(args.host))
+    channel = connection.channel()
+    channel.exchange_declare(exchange="position", exchange_type="fanout")
+
+    result = channel.queue_declare(queue='', exclusive=True)
+    queue_name = result.method.queue
+    channel.queue_bind(exchange="position", queue=queue_name)
+
+    def callback(ch, method, properties, body):
+        data = json.loads(body.decode())
+        # A swarm sends a list of positions per message
+        log.write(time.time(), data if isinstance(data, list) else [data])
+
+    def flush():
+        log.flush()
+        connection.call_later(FLUSH_SECONDS, flush)
+
+    connection.call_later(FLUSH_SECONDS, flush)
+    channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
+
+    print(f"📼 Capturing positions to {args.log}...")
+    try:
+        channel.start_consuming()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log.close()
+        print(f"💾 Wrote {log.count} positions for {len(log.ids)} people")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,89 @@
 import pika
 import json
 import argparse
+import time
+import uuid
+from datetime import datetime
 
 def parse_args():
-    parser = argparse.ArgumentParser(description="Query a person's contact history")
-    parser.add_argument("person_id", help="Name of the person to query")
+    parser = argparse.ArgumentParser(description="Query people's contact history")
+    parser.add_argument("person_id", nargs="+", help="Names of the people to query, answered in one batch")
     parser.add_argument("--host", default="localhost", help="RabbitMQ host")
-    return parser.parse_args()
+    parser.add_argument("--days", type=float, help="Only contacts from the last N days (default: all retained)")
+    parser.add_argument("--since", type=parse_time,
+                        help="Only contacts from this time on: ISO date/time (e.g. 2024-05-01T09:00) or epoch seconds")
+    parser.add_argument("--depth", type=int, default=1,
+                        help="Follow contacts of contacts up to this many hops (default: 1, direct contacts)")
+    args = parser.parse_args()
+    if args.depth < 1:
+        parser.error("--depth must be at least 1")
+    return args
+
+def parse_time(text):
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+def format_time(ts):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+
+def print_response(response, depth):
+    if "exposures" in response:
+        print(f"\n📋 People within {depth} hops of {response['person']}, earliest exposure first:")
+        for contact in response["exposures"]:
+            print(f" - {contact['id']} ({contact['hops']} hops via {contact['via']}, "
+                  f"exposed from {format_time(contact['exposed_at'])})")
+    else:
+        print(f"\n📋 Contact list for {response['person']}:")
+        for contact in response.get("details") or [{"id": name} for name in response["contacts"]]:
+            if "last_seen" in contact:
+                print(f" - {contact['id']} (last seen {format_time(contact['last_seen'])} at {tuple(contact['cell'])})")
+            else:
+                print(f" - {contact['id']}")
+    if not response["contacts"]:
+        print("No contacts found.")
 
 def main():
     args = parse_args()
-    person_id = args.person_id
+    people = args.person_id
 
     connection = pika.BlockingConnection(pika.ConnectionParameters(args.host))
     channel = connection.channel()
 
-    # Declare exchanges
     channel.exchange_declare(exchange="query", exchange_type="fanout")
-    channel.exchange_declare(exchange="query-response", exchange_type="fanout")
 
-    # Set up a queue to receive responses
+    # The tracker replies straight to this queue, so it needs no binding
     result = channel.queue_declare(queue='', exclusive=True)
     queue_name = result.method.queue
-    channel.queue_bind(exchange="query-response", queue=queue_name)
+    correlation_id = str(uuid.uuid4())
 
     # Send the query
-    channel.basic_publish(exchange="query", routing_key="", body=person_id.encode())
-    print(f"📨 Sent query for {person_id}. Waiting for response...")
+    query = {"people": people} if len(people) > 1 else {"person": people[0]}
+    if args.since is not None:
+        query["since"] = args.since
+    elif args.days is not None:
+        # Whole minutes, so repeating the query can be answered from the tracker's cache
+        query["since"] = (time.time() - args.days * 86400) // 60 * 60
+    if args.depth > 1:
+        query["depth"] = args.depth
+    # A bare name is the original query format
+    body = json.dumps(query) if len(query) > 1 or "people" in query else people[0]
+    channel.basic_publish(
+        exchange="query",
+        routing_key="",
+        properties=pika.BasicProperties(reply_to=queue_name, correlation_id=correlation_id),
+        body=body.encode()
+    )
+    print(f"📨 Sent query for {', '.join(people)}. Waiting for response...")
 
-    # Wait for the response (once)
+    # Wait for the reply to this query, ignoring anything else
     def callback(ch, method, properties, body):
+        if properties.correlation_id != correlation_id:
+            return
         response = json.loads(body.decode())
-        print(f"\n📋 Contact list for {response['person']}:")
-        if response["contacts"]:
-            for name in response["contacts"]:
-                print(f" - {name}")
-        else:
-            print("No contacts found.")
+        for result in response.get("results") or [response]:
+            print_response(result, args.depth)
         connection.close()
 
     channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
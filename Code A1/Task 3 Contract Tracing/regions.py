@@ -0,0 +1,46 @@
+"""Grid regions, for running the tracker as several shards.
+
+The grid is cut into square regions of REGION_SIZE cells. Publishers send
+each position to the `position` fanout with its region as the routing key,
+region.<rx>.<ry>. The fanout is bound to the `position-regions` topic
+exchange, so consumers of the fanout (the GUI, an unsharded tracker) still
+see every move, while a tracker shard only binds the regions its rectangle
+of cells covers.
+
+A shard's rectangle is X0,Y0,X1,Y1 in cells, X1 and Y1 excluded. It does
+not have to line up with region boundaries: a shard binds every region its
+rectangle touches and ignores the cells it does not own.
+"""
+
+REGION_SIZE = 16  # cells per region side
+
+
+def region_key(x, y, size=REGION_SIZE):
+    return f"region.{x // size}.{y // size}"
+
+
+def parse_bounds(text):
+    x0, y0, x1, y1 = (int(n) for n in text.split(","))
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f"empty rectangle {text}")
+    return x0, y0, x1, y1
+
+
+def contains(bounds, x, y):
+    x0, y0, x1, y1 = bounds
+    return x0 <= x < x1 and y0 <= y < y1
+
+
+def region_keys(bounds, size=REGION_SIZE):
+    """Routing keys of every region the rectangle touches."""
+    x0, y0, x1, y1 = bounds
+    return [f"region.{rx}.{ry}"
+            for rx in range(x0 // size, (x1 - 1) // size + 1)
+            for ry in range(y0 // size, (y1 - 1) // size + 1)]
+
+
+def declare_exchanges(channel):
+    channel.exchange_declare(exchange="position", exchange_type="fanout")
+    channel.exchange_declare(exchange="position-regions", exchange_type="topic")
+    # Messages keep their routing key across the exchange-to-exchange binding
+    channel.exchange_bind(destination="position-regions", source="position")
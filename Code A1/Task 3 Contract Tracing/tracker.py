@@ -1,27 +1,374 @@
 import pika
 import json
-from collections import defaultdict
+import argparse
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from contact_store import ContactStore, DEFAULT_RETENTION, DEFAULT_SEGMENT, spread
+import regions
+
+FLUSH_SECONDS = 60  # how often the open contact segment is written to disk
+QUERY_TIMEOUT = 5   # seconds the query router waits for every shard to answer
+CACHE_SIZE = 1000   # cached answers of each kind; the least recently used go first
 
 # Track positions and contacts
 current_positions = {}  # { person_id: (x, y) }
-contacts = defaultdict(list)  # { person_id: [other_id, ...] }
+cells = defaultdict(set)  # { (x, y): {person_id, ...} }, kept in step with current_positions
+store = ContactStore()  # contact history; main() swaps in one backed by disk
+
+class AnswerCache:
+    """Query answers keyed by tuples starting with the person asked about.
+
+    Holds at most size answers, dropping the least recently used, so clients
+    asking with a fresh `since` every time cannot grow it without bound.
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.answers = OrderedDict()    # { key: answer }, least recently used first
+        self.by_person = defaultdict(set)  # { person_id: {key, ...} }
+
+    def get(self, key):
+        answer = self.answers.get(key)
+        if answer is not None:
+            self.answers.move_to_end(key)
+        return answer
+
+    def put(self, key, answer):
+        self.answers[key] = answer
+        self.answers.move_to_end(key)
+        self.by_person[key[0]].add(key)
+        while len(self.answers) > self.size:
+            old, _ = self.answers.popitem(last=False)
+            self.discard_key(old)
+
+    def discard_key(self, key):
+        keys = self.by_person.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_person[key[0]]
+
+    def drop(self, person):
+        for key in self.by_person.pop(person, ()):
+            del self.answers[key]
+
+    def clear(self):
+        self.answers.clear()
+        self.by_person.clear()
+
+# Cached query answers, dropped whenever a contact could change them
+direct_cache = AnswerCache()    # { (person_id, since, until): answer }
+exposure_cache = AnswerCache()  # { (person_id, depth, since): answer }
+
+# Partitioned mode (--bounds): the rectangle of cells this shard owns, and the
+# seq of each person's latest move, so a late handoff cannot evict someone
+# who has already come back
+bounds = None
+last_seq = {}  # { person_id: seq }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Track positions and record contacts")
+    parser.add_argument("--host", default="localhost", help="RabbitMQ host")
+    parser.add_argument("--data", help="Directory for contact history (default: contact_data, "
+                                       "or contact_data-X0_Y0_X1_Y1 for a shard)")
+    parser.add_argument("--retention-days", type=float, default=DEFAULT_RETENTION / 86400,
+                        help="Days of contact history to keep (default: 14)")
+    parser.add_argument("--segment-minutes", type=float, default=DEFAULT_SEGMENT / 60,
+                        help="Minutes of contacts per on-disk segment (default: 60)")
+    parser.add_argument("--bounds", metavar="X0,Y0,X1,Y1",
+                        help="Run as a shard owning these cells (X1, Y1 excluded); "
+                             "answers queries only through a --router")
+    parser.add_argument("--region-size", type=int, default=regions.REGION_SIZE,
+                        help=f"Cells per region side; must match the publishers (default: {regions.REGION_SIZE})")
+    parser.add_argument("--router", action="store_true",
+                        help="Answer queries by asking every shard and merging their answers")
+    parser.add_argument("--shards", type=int, default=1, help="Number of shards the router waits for (default: 1)")
+    args = parser.parse_args()
+    if args.bounds:
+        try:
+            args.bounds = regions.parse_bounds(args.bounds)
+        except ValueError as e:
+            parser.error(f"--bounds: {e}")
+    if args.data is None:
+        args.data = "contact_data" if not args.bounds else "contact_data-" + "_".join(map(str, args.bounds))
+    return args
+
+def leave(person):
+    # Take person off the grid, ending any meetings in their cell
+    cell = current_positions.pop(person, None)
+    if cell is None:
+        return
+    occupants = cells[cell]
+    occupants.discard(person)
+    for other_person in occupants:
+        store.end(person, other_person)
+    if not occupants:
+        del cells[cell]
 
 def handle_position_update(data):
+    """Returns True if person was not on this tracker's grid before."""
     person = data["id"]
     x, y = data["x"], data["y"]
+    cell = (x, y)
+    now = time.time()
+    if "seq" in data:
+        last_seq[person] = data["seq"]
+
+    # Leave the old cell, ending any meetings there
+    previous = current_positions.get(person)
+    if previous is not None and previous != cell:
+        leave(person)
 
-    # Check for contact
-    for other_person, (ox, oy) in current_positions.items():
-        if other_person != person and (ox, oy) == (x, y):
-            if other_person not in contacts[person]:
-                contacts[person].append(other_person)
-                contacts[other_person].append(person)
+    # Check for contact with whoever is already in the new cell
+    occupants = cells[cell]
+    for other_person in occupants:
+        if other_person != person:
+            if store.record(person, other_person, cell, now):
                 print(f"👥 {person} met {other_person} at ({x}, {y})")
+            # A meeting that carries on still moves its last_seen
+            invalidate(person, other_person)
+
+    occupants.add(person)
+    current_positions[person] = cell
+    return previous is None
+
+def handle_handoff(data):
+    # Another shard now has this person; drop them here unless we have
+    # since seen a newer move of theirs
+    person = data["id"]
+    seq, mine = data.get("seq"), last_seq.get(person)
+    if seq is not None and mine is not None and mine > seq:
+        return
+    leave(person)
+    last_seq.pop(person, None)
+
+def invalidate(person, other_person):
+    # A contact changes both people's direct answers, and could change any
+    # transitive one
+    direct_cache.drop(person)
+    direct_cache.drop(other_person)
+    exposure_cache.clear()
 
-    current_positions[person] = (x, y)
+def clear_caches():
+    # Expired history takes contacts out of any answer
+    direct_cache.clear()
+    exposure_cache.clear()
+
+def parse_query(body):
+    # A bare name asks for all retained history; JSON can add a time range,
+    # a depth for transitive exposure, and a "people" list to batch queries
+    text = body.decode()
+    if text.startswith("{"):
+        return json.loads(text)
+    return {"person": text}
+
+def exposure_answer(person, exposed):
+    return {
+        "person": person,
+        "contacts": sorted(exposed),
+        "exposures": [dict(exposed[name], id=name) for name in sorted(exposed, key=lambda n: exposed[n]["exposed_at"])]
+    }
+
+def answer_query(query):
+    person = query["person"]
+    depth = query.get("depth", 1)
+
+    if query.get("meetings"):
+        # Raw meetings, for a router working out exposure across shards
+        return {"person": person, "meetings": store.meetings(person, query.get("since"))}
+
+    if depth > 1:
+        key = (person, depth, query.get("since"))
+        answer = exposure_cache.get(key)
+        if answer is None:
+            answer = exposure_answer(person, store.exposure(person, depth, query.get("since")))
+            exposure_cache.put(key, answer)
+        return answer
+
+    key = (person, query.get("since"), query.get("until"))
+    answer = direct_cache.get(key)
+    if answer is None:
+        found = store.contacts(person, query.get("since"), query.get("until"))
+        answer = {
+            "person": person,
+            "contacts": sorted(found),
+            "details": [dict(found[name], id=name) for name in sorted(found)]
+        }
+        direct_cache.put(key, answer)
+    return answer
+
+def answer_batch(query):
+    if "people" not in query:
+        return answer_query(query)
+    return {"results": [answer_query(dict(query, person=person)) for person in query["people"]]}
+
+def reply(channel, properties, answer):
+    response = json.dumps(answer).encode()
+    if properties.reply_to:
+        # Reply to the requester only
+        channel.basic_publish(
+            exchange="",
+            routing_key=properties.reply_to,
+            properties=pika.BasicProperties(correlation_id=properties.correlation_id),
+            body=response
+        )
+    else:
+        # Older clients listen on the shared fanout
+        channel.basic_publish(exchange="query-response", routing_key="", body=response)
+
+def merge_contacts(people, replies):
+    # The same pair can have met on several shards: keep the earliest first
+    # meeting (and its cell) and the latest last_seen, as ContactStore does
+    results = []
+    for i, person in enumerate(people):
+        found = {}
+        for shard_reply in replies:
+            for contact in shard_reply["results"][i]["details"]:
+                entry = found.get(contact["id"])
+                if entry is None:
+                    found[contact["id"]] = contact
+                else:
+                    if contact["first_seen"] < entry["first_seen"]:
+                        entry.update(cell=contact["cell"], first_seen=contact["first_seen"])
+                    entry["last_seen"] = max(entry["last_seen"], contact["last_seen"])
+        results.append({
+            "person": person,
+            "contacts": sorted(found),
+            "details": [found[name] for name in sorted(found)]
+        })
+    return results
+
+def merge_meetings(replies):
+    graph = {}
+    for shard_reply in replies:
+        for result in shard_reply["results"]:
+            mine = graph.setdefault(result["person"], {})
+            for other, meetings in result["meetings"].items():
+                mine.setdefault(other, []).extend(meetings)
+    for mine in graph.values():
+        for meetings in mine.values():
+            meetings.sort()
+    return graph
+
+class QueryRouter:
+    """Front end for partitioned trackers: sends each query to every shard
+    and merges their answers into what a single tracker would have said."""
+
+    def __init__(self, connection, channel, shards):
+        self.connection = connection
+        self.channel = channel
+        self.shards = shards
+        self.pending = {}  # { correlation_id: (shard replies so far, on_done) }
+
+        result = channel.queue_declare(queue='', exclusive=True)
+        self.queue = result.method.queue
+        channel.basic_consume(queue=self.queue, on_message_callback=self.on_reply, auto_ack=True)
+
+    def ask(self, query, on_done):
+        correlation_id = str(uuid.uuid4())
+        self.pending[correlation_id] = ([], on_done)
+        self.channel.basic_publish(
+            exchange="query-shards",
+            routing_key="",
+            properties=pika.BasicProperties(reply_to=self.queue, correlation_id=correlation_id),
+            body=json.dumps(query).encode()
+        )
+        self.connection.call_later(QUERY_TIMEOUT, lambda: self.expire(correlation_id))
+
+    def on_reply(self, ch, method, properties, body):
+        entry = self.pending.get(properties.correlation_id)
+        if entry is None:
+            return
+        replies, on_done = entry
+        replies.append(json.loads(body.decode()))
+        if len(replies) == self.shards:
+            del self.pending[properties.correlation_id]
+            on_done(replies)
+
+    def expire(self, correlation_id):
+        # Answer with what arrived rather than leave the client waiting
+        entry = self.pending.pop(correlation_id, None)
+        if entry is not None:
+            replies, on_done = entry
+            print(f"⚠️ Only {len(replies)} of {self.shards} shards answered in {QUERY_TIMEOUT}s")
+            on_done(replies)
+
+    def on_query(self, ch, method, properties, body):
+        query = parse_query(body)
+        people = query.get("people") or [query["person"]]
+        print(f"🔍 Query for {', '.join(people)}")
+
+        def respond(results):
+            reply(self.channel, properties, {"results": results} if "people" in query else results[0])
+
+        if query.get("depth", 1) > 1:
+            self.expose(people, query.get("depth"), query.get("since"), respond)
+        else:
+            self.ask(dict(query, people=people), lambda replies: respond(merge_contacts(people, replies)))
+
+    def expose(self, people, depth, since, respond):
+        # Exposure can cross shards, so the router runs the search itself and
+        # asks the shards for the meetings of each round's frontier
+        walks = {person: spread(person, depth, since) for person in people}
+        frontiers = {person: next(walk) for person, walk in walks.items()}
+        reached = {}
+
+        def step(replies):
+            graph = merge_meetings(replies)
+            for person in list(frontiers):
+                try:
+                    frontiers[person] = walks[person].send(graph)
+                except StopIteration as done:
+                    del frontiers[person]
+                    reached[person] = done.value
+            ask_next()
+
+        def ask_next():
+            if not frontiers:
+                respond([
+                    exposure_answer(person, {
+                        other: {"hops": hops, "exposed_at": at, "via": via}
+                        for other, (hops, at, via) in reached[person].items()
+                    })
+                    for person in people
+                ])
+                return
+            asked = sorted(set().union(*frontiers.values()))
+            self.ask({"people": asked, "meetings": True, "since": since}, step)
+
+        ask_next()
+
+def run_router(args):
+    connection = pika.BlockingConnection(pika.ConnectionParameters(args.host))
+    channel = connection.channel()
+    channel.exchange_declare(exchange="query", exchange_type="fanout")
+    channel.exchange_declare(exchange="query-response", exchange_type="fanout")
+    channel.exchange_declare(exchange="query-shards", exchange_type="fanout")
+
+    router = QueryRouter(connection, channel, args.shards)
+
+    query_result = channel.queue_declare(queue='', exclusive=True)
+    query_queue = query_result.method.queue
+    channel.queue_bind(exchange="query", queue=query_queue)
+    channel.basic_consume(queue=query_queue, on_message_callback=router.on_query, auto_ack=True)
+
+    print(f"📡 Query router is running across {args.shards} shards...")
+    channel.start_consuming()
 
 def main():
-    connection = pika.BlockingConnection(pika.ConnectionParameters("localhost"))
+    global store, bounds
+    args = parse_args()
+    if args.router:
+        run_router(args)
+        return
+
+    bounds = args.bounds
+    store = ContactStore(args.data, args.retention_days * 86400, args.segment_minutes * 60)
+    store.on_expire = clear_caches
+    shard_name = ",".join(map(str, bounds)) if bounds else None
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters(args.host))
     channel = connection.channel()
 
     # Declare exchanges
@@ -29,40 +376,81 @@ def main():
     channel.exchange_declare(exchange="query", exchange_type="fanout")
     channel.exchange_declare(exchange="query-response", exchange_type="fanout")
 
-    # POSITION listener
+    # POSITION listener: everything, or just this shard's regions
     pos_result = channel.queue_declare(queue='', exclusive=True)
     pos_queue = pos_result.method.queue
-    channel.queue_bind(exchange="position", queue=pos_queue)
+    if bounds:
+        regions.declare_exchanges(channel)
+        channel.exchange_declare(exchange="tracker-handoff", exchange_type="fanout")
+        channel.exchange_declare(exchange="query-shards", exchange_type="fanout")
+        for key in regions.region_keys(bounds, args.region_size):
+            channel.queue_bind(exchange="position-regions", queue=pos_queue, routing_key=key)
+    else:
+        channel.queue_bind(exchange="position", queue=pos_queue)
 
     def on_position(ch, method, properties, body):
         data = json.loads(body.decode())
-        handle_position_update(data)
+        arrived = []
+        # A swarm sends a list of positions per message
+        for position in data if isinstance(data, list) else [data]:
+            if bounds and not regions.contains(bounds, position["x"], position["y"]):
+                # A neighbour's cell in a region we share: they have left us
+                leave(position["id"])
+            elif handle_position_update(position) and bounds:
+                arrived.append({"id": position["id"], "seq": position.get("seq")})
+
+        if arrived:
+            # New here, so whichever shard had them last can let go
+            channel.basic_publish(
+                exchange="tracker-handoff",
+                routing_key="",
+                body=json.dumps({"shard": shard_name, "people": arrived}).encode()
+            )
 
     channel.basic_consume(queue=pos_queue, on_message_callback=on_position, auto_ack=True)
 
-    # QUERY listener
+    if bounds:
+        handoff_result = channel.queue_declare(queue='', exclusive=True)
+        handoff_queue = handoff_result.method.queue
+        channel.queue_bind(exchange="tracker-handoff", queue=handoff_queue)
+
+        def on_handoff(ch, method, properties, body):
+            data = json.loads(body.decode())
+            if data["shard"] != shard_name:
+                for person in data["people"]:
+                    handle_handoff(person)
+
+        channel.basic_consume(queue=handoff_queue, on_message_callback=on_handoff, auto_ack=True)
+
+    # QUERY listener; shards only answer the router
     query_result = channel.queue_declare(queue='', exclusive=True)
     query_queue = query_result.method.queue
-    channel.queue_bind(exchange="query", queue=query_queue)
+    channel.queue_bind(exchange="query-shards" if bounds else "query", queue=query_queue)
 
     def on_query(ch, method, properties, body):
-        person_id = body.decode()
-        print(f"🔍 Query for {person_id}")
-        contact_list = contacts.get(person_id, [])
-        response = {
-            "person": person_id,
-            "contacts": contact_list
-        }
-        channel.basic_publish(
-            exchange="query-response",
-            routing_key="",
-            body=json.dumps(response).encode()
-        )
+        query = parse_query(body)
+        if not query.get("meetings"):
+            print(f"🔍 Query for {', '.join(query.get('people') or [query['person']])}")
+        reply(channel, properties, answer_batch(query))
 
     channel.basic_consume(queue=query_queue, on_message_callback=on_query, auto_ack=True)
 
-    print("📡 Tracker is running...")
-    channel.start_consuming()
+    def flush_store():
+        # Expire here too: segments only roll over while contacts keep coming
+        store.expire(time.time())
+        store.flush()
+        connection.call_later(FLUSH_SECONDS, flush_store)
+
+    connection.call_later(FLUSH_SECONDS, flush_store)
+
+    if bounds:
+        print(f"📡 Tracker shard for cells {shard_name} is running...")
+    else:
+        print("📡 Tracker is running...")
+    try:
+        channel.start_consuming()
+    finally:
+        store.flush()
 
 if __name__ == "__main__":
     main()